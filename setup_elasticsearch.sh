@@ -17,6 +17,12 @@ wait_for_elasticsearch(){
     done
 }
 
+configure() {
+    # Inline (groovy) scripts are disabled by default, tests of
+    # write_mode = script and freshness_mode = update_by_query need them
+    echo "script.inline: true" >> "${1}/config/elasticsearch.yml"
+}
+
 run() {
     echo "Starting elasticsearch ..."
     cd $1/bin
@@ -31,6 +37,7 @@ download_and_run() {
     dir_name="$(readlink -f "elasticsearch-$1")"
 
     download $url
+    configure $dir_name
 
     # Run elasticsearch
     run $dir_name
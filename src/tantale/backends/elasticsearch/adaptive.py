@@ -0,0 +1,89 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+import threading
+
+# Smoothing of measures (exponential moving average weight)
+SMOOTHING = 0.3
+# Batch size factor on rejection (cluster overloaded)
+BACKOFF = 0.5
+# Maximum batch size increase factor by update
+GROWTH = 1.5
+
+
+class BatchController(object):
+    """
+    Adapt batch size and flush delay (ttl) to a target latency
+
+    Latency of a check is about its batch fill time plus bulk round trip:
+        batch / arrival rate + rtt
+    Batch is moved to arrival rate * (target - rtt), at most GROWTH times
+    each update, divided by 2 on rejections (HTTP 429).
+    Flush delay is target - rtt. Both are kept within bounds.
+    """
+
+    def __init__(
+        self, batch, target, batch_min, batch_max, ttl_min, ttl_max
+    ):
+        self.target = target
+        self.batch_min = batch_min
+        self.batch_max = batch_max
+        self.ttl_min = ttl_min
+        self.ttl_max = ttl_max
+
+        self.batch = min(max(batch, batch_min), batch_max)
+        self.ttl = ttl_max
+
+        # Measures
+        self.rtt = 0
+        self.rate = 0
+        self.arrivals = 0
+        self.rejections = 0
+        self.ts = time.time()
+
+        self.lock = threading.Lock()
+
+    def sent(self, rtt, arrivals, rejected=0):
+        """
+        Account a bulk (round trip seconds, rejected checks)
+        arrivals is the count of checks received so far
+        """
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.ts
+            if elapsed > 0:
+                rate = (arrivals - self.arrivals) / elapsed
+                self.rate += SMOOTHING * (rate - self.rate)
+            self.arrivals = arrivals
+            self.ts = now
+
+            self.rtt += SMOOTHING * (rtt - self.rtt)
+
+            if rejected:
+                self.rejections += rejected
+                batch = self.batch * BACKOFF
+            else:
+                batch = min(
+                    self.rate * max(self.target - self.rtt, 0),
+                    self.batch * GROWTH)
+
+            self.batch = int(min(max(batch, self.batch_min), self.batch_max))
+            self.ttl = min(
+                max(self.target - self.rtt, self.ttl_min), self.ttl_max)
+
+    def report(self):
+        """
+        Current values and measures (rejections reset)
+        """
+        with self.lock:
+            values = {
+                'batch': self.batch,
+                'ttl': self.ttl,
+                'rate': self.rate,
+                'rtt': self.rtt,
+                'rejections': self.rejections,
+            }
+            self.rejections = 0
+        return values
@@ -23,16 +23,42 @@ using "update/create" API
 from __future__ import print_function
 
 import os
-import json
 import time
 from datetime import datetime
 import traceback
 from six import string_types
 
+from tantale import codec
 from tantale.backend import BaseBackend
 from tantale.utils import str_to_bool
 
 from elasticsearch.client import Elasticsearch
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.exceptions import SerializationError
+
+# Retries of host documents service_states updates on version conflict
+# (concurrent Input bulks and Livestatus commands)
+SERVICE_STATES_RETRIES = 5
+
+
+class CodecSerializer(JSONSerializer):
+    """
+    Elasticsearch client serializer using tantale codec
+    Fallback on client one for types codec does not handle
+    """
+    def loads(self, s):
+        try:
+            return codec.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        if isinstance(data, string_types):
+            return data
+        try:
+            return codec.dumps(data)
+        except (ValueError, TypeError, OverflowError):
+            return super(CodecSerializer, self).dumps(data)
 
 
 class ElasticsearchBaseBackend(BaseBackend):
@@ -60,6 +86,9 @@ class ElasticsearchBaseBackend(BaseBackend):
 
         self.request_timeout = int(self.config['request_timeout'])
 
+        # Connections by host (at least one per in-flight bulk)
+        self.maxsize = max(10, int(self.config['concurrency']))
+
         # Initialize tantale specific options
         self.status_index = self.config['status_index']
         self.log_index = self.config['log_index']
@@ -95,6 +124,30 @@ class ElasticsearchBaseBackend(BaseBackend):
             'request_timeout': 'Elasticsearch client option',
             'batch': 'How many checks to store before sending',
             'backlog_size': 'How many checks to keep before trimming',
+            'status_cache_size': 'How many status documents to cache'
+                                 ' (Input, 0 to disable)',
+            'write_mode': 'Status changes detection (mget|script)',
+            'concurrency': 'How many bulk requests in flight (Input)',
+            'spool_path': 'Directory to spool unsent checks (Input)',
+            'spool_max_bytes': 'Maximum spool size',
+            'spool_fsync': 'Spool fsync policy (always|segment|never)',
+            'spool_replay_rate': 'Spooled checks replayed per second',
+            'adaptive': 'Adapt batch and flush delay to target_latency',
+            'target_latency': 'Target checks latency (seconds, adaptive)',
+            'batch_min': 'Minimum batch (adaptive)',
+            'batch_max': 'Maximum batch (adaptive)',
+            'ttl_min': 'Minimum flush delay (seconds, adaptive)',
+            'ttl_max': 'Maximum flush delay (seconds, adaptive)',
+            'heartbeat_compaction': 'Part of freshness window before'
+                                    ' writing unchanged checks (Input,'
+                                    ' 0 to disable)',
+            'output_min_interval': 'Seconds between output only changes'
+                                   ' writes (heartbeat_compaction)',
+            'service_states': 'Keep services states in host documents'
+                              ' (Livestatus num_services_* columns)',
+            'service_states_rebuild': 'Seconds between service_states'
+                                      ' rebuilds from services (Input,'
+                                      ' 0 on startup only)',
         })
 
         return config
@@ -119,6 +172,23 @@ class ElasticsearchBaseBackend(BaseBackend):
             'request_timeout': 30,
             'batch': 1,
             'backlog_size': 50,
+            'status_cache_size': 0,
+            'write_mode': 'mget',
+            'concurrency': 1,
+            'spool_path': '',
+            'spool_max_bytes': 1073741824,
+            'spool_fsync': 'segment',
+            'spool_replay_rate': 1000,
+            'adaptive': False,
+            'target_latency': 1,
+            'batch_min': 10,
+            'batch_max': 5000,
+            'ttl_min': 0.05,
+            'ttl_max': 5,
+            'heartbeat_compaction': 0,
+            'output_min_interval': 0,
+            'service_states': False,
+            'service_states_rebuild': 3600,
         })
 
         return config
@@ -147,6 +217,8 @@ class ElasticsearchBaseBackend(BaseBackend):
                     sniffer_timeout=self.sniffer_timeout,
                     sniff_on_start=self.sniff_on_start,
                     sniff_on_connection_fail=self.sniff_on_connection_fail,
+                    maxsize=self.maxsize,
+                    serializer=CodecSerializer(),
                 )
                 self.log.info("ElasticsearchBackend: connection established")
 
@@ -166,19 +238,19 @@ class ElasticsearchBaseBackend(BaseBackend):
                     os.path.abspath(__file__)), 'status.template')
                 with open(file, 'r') as f:
                     name = "tantale_%s" % self.status_index
-                    template = json.loads(f.read())
+                    template = codec.loads(f.read())
                     template['template'] = self.status_index
                     self.elasticclient.indices.put_template(
-                        name, body=json.dumps(template))
+                        name, body=codec.dumps(template))
 
                 file = os.path.join(os.path.dirname(
                     os.path.abspath(__file__)), 'status_logs.template')
                 with open(file, 'r') as f:
                     name = "tantale_%s" % self.log_index
-                    template = json.loads(f.read())
+                    template = codec.loads(f.read())
                     template['template'] = "%s-*" % self.log_index
                     self.elasticclient.indices.put_template(
-                        name, body=json.dumps(template))
+                        name, body=codec.dumps(template))
             except:
                 # Log Error
                 self._throttle_error(
@@ -0,0 +1,71 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 (Pypi 'ordereddict')
+    from ordereddict import OrderedDict
+
+# Seconds before freshness deadline an entry is not trusted anymore
+# (freshness worker may be outdating the document)
+FRESHNESS_GRACE = 5
+
+
+class StatusCache(object):
+    """
+    LRU cache of status documents fields, by check id
+        (status, timestamp, freshness, last_check, digest) - timestamps in ms
+        digest : output and contacts hash (heartbeat compaction)
+
+    Only valid while this process is the only one updating status
+    and timestamp (freshness worker handled by ignoring outdated entries)
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return entry or None (missing or near freshness deadline)
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if (time.time() + FRESHNESS_GRACE) * 1000 >= entry[2]:
+            self.misses += 1
+            return None
+
+        # Most recently used last
+        self.entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def set(
+        self, key, status, timestamp, freshness, last_check=None, digest=None
+    ):
+        self.entries.pop(key, None)
+        self.entries[key] = (status, timestamp, freshness, last_check, digest)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def full(self):
+        return len(self.entries) >= self.size
+
+    def evict(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
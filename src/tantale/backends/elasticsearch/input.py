@@ -2,17 +2,155 @@
 
 from __future__ import print_function
 
-import json
 import time
+import bisect
+import socket
 import logging
+import itertools
+import threading
 import traceback
 from datetime import datetime
 
+try:
+    from Queue import Queue
+except:
+    from queue import Queue
+
+from tantale import codec
+from tantale.backends.elasticsearch.adaptive import BatchController
 from tantale.backends.elasticsearch.base import ElasticsearchBaseBackend
-from tantale.input.backend import Backend
+from tantale.backends.elasticsearch.base import SERVICE_STATES_RETRIES
+from tantale.backends.elasticsearch.cache import StatusCache
+from tantale.input.backend import Backend, REBUILD_RETRY
 from tantale.input.check import Check
+from tantale.input.spool import Spool
+from tantale.utils import str_to_bool
 
 from elasticsearch import helpers
+from elasticsearch.exceptions import ElasticsearchException, TransportError
+
+# Status update script (write_mode = script), groovy
+#   skip checks older than last written one (replayed spool), apply
+#   status transitions, keep previous values to build logs from bulk
+#   response, skip unchanged checks heartbeats (before refresh, output
+#   changes before output_interval)
+STATUS_SCRIPT = (
+    "def last = ctx._source.last_check ?: ctx._source.timestamp; "
+    "if (last > timestamp) { ctx.op = 'none' } else { "
+    "ctx._source.previous_status = ctx._source.status; "
+    "ctx._source.previous_timestamp = ctx._source.timestamp; "
+    "ctx._source.previous_last_check = last; "
+    "for (t in transitions) { "
+    "if (t[0] >= last && t[1] != ctx._source.status) { "
+    "ctx._source.status = t[1]; ctx._source.timestamp = t[0]; "
+    "ctx._source.ack = 0 } }; "
+    "def elapsed = timestamp - last; "
+    "if (ctx._source.status == ctx._source.previous_status && "
+    "ctx._source.timestamp == ctx._source.previous_timestamp && "
+    "elapsed < refresh && (elapsed < output_interval || "
+    "(ctx._source.output == values.output && "
+    "ctx._source.contacts == values.contacts))) { ctx.op = 'none' } "
+    "else { ctx._source.putAll(values) } }"
+)
+STATUS_SCRIPT_FIELDS = ['status', 'timestamp', 'last_check',
+                        'previous_status', 'previous_timestamp',
+                        'previous_last_check']
+
+# Outdate script (freshness_mode = update_by_query), groovy
+#   same update as freshness scan (status only if OK)
+OUTDATE_SCRIPT = (
+    "if (ctx._source.status == 0) { ctx._source.status = status }; "
+    "ctx._source.timestamp = now; "
+    "ctx._source.output = prefix + ctx._source.output"
+)
+# Startup grace filter (freshness_mode = update_by_query), groovy
+#   same rule as grace_deadline
+GRACE_SCRIPT = (
+    "def last = doc['last_check'].empty ? "
+    "doc['timestamp'].value : doc['last_check'].value; "
+    "last >= start || now >= start + doc['freshness'].value - last"
+)
+
+# Seconds between bulk slots latency reports
+SLOT_REPORT_INTERVAL = 60
+
+# Seconds by log index name bucket (timezones offsets are multiples)
+LOG_INDEX_BUCKET = 900
+# Logs by bulk request
+LOGS_CHUNK = 1000
+
+# Seconds before outdating checks again when backend fails (heap mode)
+FRESHNESS_RETRY = 10
+
+# Freshness partitions leases (status index documents type)
+LEASE_TYPE = 'freshness_lease'
+
+
+def grace_deadline(source, start):
+    """
+    Freshness deadline (ms) of a status document source, with startup
+    grace : checks last seen before start (ms) are outdated one freshness
+    delay after start. Shared by all freshness modes (GRACE_SCRIPT)
+    """
+    last = source.get('last_check', source.get('timestamp', 0))
+    if last >= start:
+        return source['freshness']
+    return max(source['freshness'], start + source['freshness'] - last)
+
+
+class BulkSlot(object):
+    """
+    In-flight bulk slot, handling checks partition (by id hash)
+    Own status cache, logs and latency stats
+    """
+    def __init__(self, number, cache=None, logs=None):
+        self.number = number
+        self.cache = cache
+        if logs is None:
+            logs = []
+        self.logs = logs
+
+        # Batches queue and thread (concurrent sends only)
+        self.queue = None
+        self.thread = None
+
+        self.bulks = 0
+        self.checks = 0
+        self.latency = 0
+        self.latency_max = 0
+        self.report_ts = time.time()
+
+        # Rejected checks (HTTP 429) of current bulk
+        self.rejected = 0
+        # Services states changed by current bulk (by hostname, check)
+        # and created hosts (service_states)
+        self.states = {}
+        self.hosts = set()
+        # Status acknowledge time of current bulk (latency trace)
+        self.acked = None
+
+    def record(self, latency, checks, log):
+        """
+        Account a sent batch, report stats periodically
+        """
+        self.bulks += 1
+        self.checks += checks
+        self.latency += latency
+        self.latency_max = max(self.latency_max, latency)
+
+        if time.time() - self.report_ts < SLOT_REPORT_INTERVAL:
+            return
+
+        log.info(
+            "ElasticsearchBackend: slot %d: %d bulks, %d checks, "
+            "latency avg %.3fs max %.3fs" % (
+                self.number, self.bulks, self.checks,
+                self.latency / self.bulks, self.latency_max))
+        self.bulks = 0
+        self.checks = 0
+        self.latency = 0
+        self.latency_max = 0
+        self.report_ts = time.time()
 
 
 class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
@@ -20,29 +158,152 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
         self.log = logging.getLogger('tantale.input')
         super(ElasticsearchBackend, self).__init__(config)
 
+        # Checks waiting by id (coalesced), ordered by timestamp
+        # self.checks keep one check by id (batch order)
+        self.pending = {}
+
+        # Encoded logs bulk action lines, by index bucket
+        self.log_actions = {}
+
+        # Status index shards number (freshness partitions)
+        self.status_shards = None
+
+        # Status change detection by update script (no mget)
+        self.scripted = self.config['write_mode'] == 'script'
+
+        # Heartbeat compaction : unchanged checks written once this part
+        # of their freshness window elapsed, output changes rate limited
+        self.compaction = float(self.config['heartbeat_compaction'])
+        self.output_interval = float(self.config['output_min_interval'])
+
+        # Services states kept in host documents (num_services_* columns)
+        self.service_states = str_to_bool(self.config['service_states'])
+        self.rebuild_interval = int(self.config['service_states_rebuild'])
+        # Outdated services states by host (freshness passes)
+        self.outdated_states = {}
+
+        # Status documents cache (avoid mget)
+        cache_size = int(self.config['status_cache_size'])
+        self.cache_loaded = self.scripted or cache_size <= 0
+
+        # In-flight bulks slots (checks partitioned by id)
+        # First one shares backend logs (sending synchronously)
+        self.concurrency = max(1, int(self.config['concurrency']))
+        self.slots = []
+        for number in range(self.concurrency):
+            cache = None
+            if not self.cache_loaded:
+                cache = StatusCache(max(1, cache_size // self.concurrency))
+            logs = None
+            if self.concurrency == 1:
+                logs = self.logs
+            self.slots.append(BulkSlot(number, cache, logs))
+
+        # Checks queued back by slots
+        self.requeued = []
+        self.requeue_lock = threading.Lock()
+
+        # Disk spool of overflowing / failed checks (replayed when sending)
+        self.spool = None
+        self.healthy = False
+        self.replay_rate = float(self.config['spool_replay_rate'])
+        self.replay_ts = time.time()
+        self.replay_allowance = 0
+        if self.config['spool_path']:
+            self.spool = Spool(
+                self.config['spool_path'],
+                int(self.config['spool_max_bytes']),
+                self.config['spool_fsync'])
+
+        # Batch size and flush delay (ttl) adapted to a target latency
+        # Concurrent slots bulks measures (rtt, rejected), adapted once
+        # by send
+        self.controller = None
+        self.arrivals = 0
+        self.controller_ts = time.time()
+        self.measures = []
+        self.measure_lock = threading.Lock()
+        if str_to_bool(self.config['adaptive']):
+            self.controller = BatchController(
+                self.batch_size,
+                float(self.config['target_latency']),
+                int(self.config['batch_min']),
+                int(self.config['batch_max']),
+                float(self.config['ttl_min']),
+                float(self.config['ttl_max']))
+            self.batch_size = self.controller.batch
+            self.ttl = self.controller.ttl
+
     def process(self, check):
         """
         Process a check by storing it in memory
         Trigger sending is batch size reached
         """
-        # Append the data to the array as a string
-        self.checks.append(check)
+        self.arrivals += 1
+        self._queue(check)
         if len(self.checks) >= self.batch_size:
             self.send()
 
+    def _queue(self, check):
+        """
+        Add check to batch
+        """
+        versions = self.pending.get(check.id)
+        if versions is None:
+            self.pending[check.id] = [check]
+            self.checks.append(check)
+            return
+
+        # Coalesce with waiting checks of this id
+        # Keep status transitions (for logs) and newest check
+        if check.timestamp >= versions[-1].timestamp:
+            if (
+                len(versions) > 1 and
+                versions[-2].status == versions[-1].status == check.status
+            ):
+                versions[-1] = check
+            else:
+                versions.append(check)
+        else:
+            # Late check (replay)
+            timestamps = [version.timestamp for version in versions]
+            versions.insert(
+                bisect.bisect_right(timestamps, check.timestamp), check)
+
+    def _requeue(self, check):
+        """
+        Queue back a check (from slots threads)
+        """
+        with self.requeue_lock:
+            self.requeued.append(check)
+
     def flush(self):
         """
         Flush queue (called on exit)
         Avoid dropping checks
         """
-        while len(self.checks) > 0:
+        while len(self.checks) > 0 or len(self.requeued) > 0:
             before = len(self.checks)
             self.send()
             if before == len(self.checks):
                 break
 
+        # Wait in-flight bulks
+        for slot in self.slots:
+            if slot.queue is not None:
+                slot.queue.join()
+
+        if self.spool is not None:
+            # Keep unsent checks
+            with self.requeue_lock:
+                for check in self.requeued:
+                    self._queue(check)
+                self.requeued = []
+            self._trim(0)
+            self.spool.close()
+
     def freshness_iterator(
-        self, query, outdated_status, prefix, start_time, timeout
+        self, query, outdated_status, prefix, start_time, timeout, **kwargs
     ):
         """
         Make a scan query then manipulate hits
@@ -60,58 +321,64 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
             size=self.batch_size,
             query=query,
             scroll="%ss" % timeout,
+            **kwargs
         ):
-            # Startup grace_time handle
-            if 'last_check' not in hit['_source']:
-                hit['_source']['last_check'] = hit['_source']['timestamp']
-
-            if (
-                hit['_source']['last_check'] < start_time and
-                now < (
-                    start_time + hit['_source']['last_check'] -
-                    hit['_source']['freshness'])
-            ):
+            # Startup grace
+            if now < grace_deadline(hit['_source'], start_time):
                 continue
 
-            hit['_op_type'] = 'update'
-            hit['doc'] = {}
+            log = self._outdate(hit, outdated_status, prefix)
 
-            # Update status only if OK before
-            if hit['_source']['status'] == 0:
-                hit['doc']['status'] = outdated_status
-            else:
-                hit['doc']['status'] = hit['_source']['status']
+            yield hit
+
+            # Update OK
+            # Forward update to _send_to_logs
+            self.logs.append(log)
+            self._outdated_state(hit['_type'], log)
 
-            hit['doc']['timestamp'] = int(time.time()) * 1000
+    @staticmethod
+    def _outdate(hit, outdated_status, prefix):
+        """
+        Turn a status hit (with _source) to its outdated update
+        Return its log entry
+        """
+        hit['_op_type'] = 'update'
+        hit['doc'] = {}
 
-            hit['doc']['output'] = prefix + hit['_source']['output']
+        # Update status only if OK before
+        if hit['_source']['status'] == 0:
+            hit['doc']['status'] = outdated_status
+        else:
+            hit['doc']['status'] = hit['_source']['status']
 
-            # Build a log entry
-            log = {}
-            for field in Check.log_fields:
-                if field in ('timestamp', 'status', 'output'):
-                    log[field] = hit['doc'][field]
-                else:
-                    log[field] = hit['_source'][field]
+        hit['doc']['timestamp'] = int(time.time()) * 1000
 
-            del hit['_source']
+        hit['doc']['output'] = prefix + hit['_source']['output']
 
-            yield hit
+        # Build a log entry
+        log = {}
+        for field in Check.log_fields:
+            if field in ('timestamp', 'status', 'output'):
+                log[field] = hit['doc'][field]
+            else:
+                log[field] = hit['_source'][field]
 
-            # Update OK
-            # Forward update to _send_to_logs
-            self.logs.append(log)
+        del hit['_source']
+        return log
 
-    def freshness(self, outdated_status, prefix, start_time, timeout):
+    def freshness(
+        self, outdated_status, prefix, start_time, timeout, partitions=None
+    ):
         """
         Get scroll on outdated, then bulk update it with values
             factor : number of intervals to loose
             outdated_status : status to be applied on outdated
             prefix : output prefix to apply on outdated
+            partitions : (handled, count) freshness partitions, None for all
         """
         try:
             now = int(time.time()) * 1000
-            search_body = json.dumps({
+            search_body = codec.dumps({
                 'size': self.batch_size, 'version': True,
                 'filter': {"and": [
                     {'range': {'freshness': {'lt': now}}},
@@ -132,11 +399,16 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
             self.log.info("ElasticsearchBackend: Reconnect failed")
             return
 
+        kwargs = self._partitions(partitions)
+        if kwargs is None:
+            return
+
         try:
             for res in helpers.streaming_bulk(
                 self.elasticclient,
                 self.freshness_iterator(
-                    search_body, outdated_status, prefix, start_time, timeout),
+                    search_body, outdated_status, prefix, start_time, timeout,
+                    **kwargs),
                 chunk_size=self.batch_size,
             ):
                 pass
@@ -147,44 +419,412 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
             self.log.info("ElasticsearchBackend: failed to update outdated")
             self.log.debug("Trace:\n%s" % traceback.format_exc())
 
+        self._send_outdated_states()
+        self._send_to_logs()
+
+    def freshness_by_query(
+        self, outdated_status, prefix, start_time, partitions=None
+    ):
+        """
+        Outdate checks in cluster (scripted update by query)
+        Logs are built from a search of updated documents (marked by
+        update timestamp)
+        """
+        if not self._connect():
+            self.log.info("ElasticsearchBackend: Reconnect failed")
+            return
+
+        kwargs = self._partitions(partitions)
+        if kwargs is None:
+            return
+
+        # Update timestamp (ms), marks this pass documents
+        now = int(time.time() * 1000)
+        outdated = [
+            {'range': {'freshness': {'lt': now}}},
+            {'script': {'script': {
+                'inline': GRACE_SCRIPT,
+                'params': {'start': int(start_time * 1000), 'now': now}}}},
+        ]
+        try:
+            res = self.elasticclient.update_by_query(
+                index=self.status_index,
+                body=codec.dumps({
+                    'query': {'bool': {
+                        'filter': outdated,
+                        'must_not': {'prefix': {'output': prefix}},
+                    }},
+                    'script': {
+                        'inline': OUTDATE_SCRIPT,
+                        'params': {
+                            'status': outdated_status, 'now': now,
+                            'prefix': prefix},
+                    },
+                }),
+                conflicts='proceed',
+                refresh=True,
+                **kwargs
+            )
+        except TransportError as e:
+            # Unreachable, or refused (400 if inline scripts are disabled)
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: failed to update outdated (%s %s)" % (
+                    e.status_code, e.error))
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+            return
+        except ElasticsearchException:
+            self.log.info("ElasticsearchBackend: failed to update outdated")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+            return
+
+        if res.get('failures'):
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: %d outdated updates failed (%s)" % (
+                    len(res['failures']), res['failures'][0]))
+        self.log.debug(
+            "ElasticsearchBackend: %d checks outdated (%d conflicts)" % (
+                res.get('updated', 0), res.get('version_conflicts', 0)))
+        if self.registry is not None:
+            self.registry.inc('freshness_outdated', res.get('updated', 0))
+        if not res.get('updated'):
+            return
+
+        try:
+            for hit in helpers.scan(
+                self.elasticclient,
+                index=self.status_index,
+                size=self.batch_size,
+                query=codec.dumps({
+                    'query': {'bool': {'filter': [
+                        {'term': {'timestamp': now}},
+                        {'prefix': {'output': prefix}},
+                    ]}},
+                    '_source': Check.log_fields,
+                }),
+                scroll='60s',
+                **kwargs
+            ):
+                self.logs.append(hit['_source'])
+                self._outdated_state(hit['_type'], hit['_source'])
+        except:
+            self.log.info(
+                "ElasticsearchBackend: failed to get outdated for logs")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+
+        self._send_outdated_states()
         self._send_to_logs()
 
-    def status_iterator(self):
+    def lease(self, partition, count, duration):
         """
-        Iterate over input checks, yielding to update it
+        Renew freshness partition lease of this Input (status index
+        document), for duration seconds
+        Return partitions with live lease, None on failure
         """
+        if not self._connect():
+            return None
+
+        owner = socket.gethostname()
+        now = int(time.time() * 1000)
+        try:
+            res = self.elasticclient.mget(
+                body=codec.dumps({
+                    'ids': [str(number) for number in range(count)]}),
+                index=self.status_index,
+                doc_type=LEASE_TYPE,
+            )
+            live = set()
+            for doc in res['docs']:
+                if not doc.get('found') or doc['_source']['expires'] < now:
+                    continue
+                live.add(int(doc['_id']))
+                if int(doc['_id']) == partition and \
+                   doc['_source']['owner'] != owner:
+                    self._throttle_error(
+                        self.log,
+                        "ElasticsearchBackend: freshness partition %d "
+                        "also held by %s" % (
+                            partition, doc['_source']['owner']))
+
+            self.elasticclient.index(
+                body=codec.dumps({
+                    'owner': owner, 'expires': now + duration * 1000}),
+                index=self.status_index,
+                doc_type=LEASE_TYPE,
+                id=str(partition),
+            )
+        except:
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: failed to renew freshness lease")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+            return None
+
+        live.add(partition)
+        return live
+
+    def _partitions(self, partitions):
+        """
+        Search arguments restricting requests to freshness partitions
+        Checks are routed by hostname (host id, service parent), status
+        index shards are partitioned (shard number modulo partitions count)
+        Return None if no shard is handled (or shards number is unknown)
+        """
+        if partitions is None:
+            return {}
+        handled, count = partitions
+
+        if self.status_shards is None:
+            try:
+                settings = self.elasticclient.indices.get_settings(
+                    index=self.status_index, name='index.number_of_shards')
+                self.status_shards = int(
+                    list(settings.values())[0]
+                    ['settings']['index']['number_of_shards'])
+            except:
+                self._throttle_error(
+                    self.log,
+                    "ElasticsearchBackend: failed to get status shards")
+                self.log.debug("Trace:\n%s" % traceback.format_exc())
+                return None
+            if self.status_shards < count:
+                self.log.warn(
+                    "ElasticsearchBackend: %d freshness partitions for %d "
+                    "status shards, some are empty" % (
+                        count, self.status_shards))
+
+        shards = [
+            shard for shard in range(self.status_shards)
+            if shard % count in handled]
+        if not shards:
+            return None
+        return {'preference': '_shards:%s' % ','.join(
+            str(shard) for shard in shards)}
+
+    def seed(self, prefix, start_time):
+        """
+        Scroll status index for freshness deadlines (freshness_mode = heap)
+        """
+        if not self._connect():
+            self._throttle_error(
+                self.log, "ElasticsearchBackend: not connected, "
+                "freshness deadlines not loaded")
+            return None
+
+        entries = []
+        try:
+            for hit in helpers.scan(
+                self.elasticclient,
+                index=self.status_index,
+                size=self.batch_size,
+                query=codec.dumps({'_source': [
+                    'freshness', 'last_check', 'timestamp', 'hostname',
+                    'output']}),
+                scroll='60s',
+            ):
+                source = hit['_source']
+                if 'freshness' not in source or \
+                   (source.get('output') or '').startswith(prefix):
+                    continue
+
+                deadline = grace_deadline(source, start_time * 1000) / 1000.0
+
+                entries.append((
+                    hit['_id'], deadline,
+                    (hit['_type'], source['hostname'])))
+        except:
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: failed to load freshness deadlines")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+            return None
+
+        self.log.info(
+            "ElasticsearchBackend: %d freshness deadlines loaded" %
+            len(entries))
+        return entries
+
+    def expire(self, expired, outdated_status, prefix):
+        """
+        Outdate checks with passed deadline (freshness_mode = heap)
+        Documents are checked first (mget), other Inputs may have got
+        newer checks. Versioned updates (conflicts are skipped).
+        """
+        if not self._connect():
+            self._retry_expired(expired)
+            return
+
         body = []
-        checks = []
-        while len(body) <= self.batch_size:
+        keys = {}
+        for check_id, deadline, (kind, hostname) in expired:
+            metadata = {'_type': kind, '_id': check_id}
+            if kind == 'service':
+                metadata['_parent'] = hostname
+            body.append(metadata)
+            keys[check_id] = (kind, hostname)
+
+        try:
+            res = self.elasticclient.mget(
+                body=codec.dumps({'docs': body}),
+                index=self.status_index,
+                _source_include=(
+                    'status', 'output', 'freshness', 'hostname', 'check'),
+            )
+        except:
+            self._throttle_error(
+                self.log, "ElasticsearchBackend: failed to get outdated")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+            self._retry_expired(expired)
+            return
+
+        now = int(time.time()) * 1000
+        hits = []
+        logs = []
+        for doc in res['docs']:
+            if not doc.get('found'):
+                continue
+            source = doc['_source']
+            if source.get('freshness', 0) > now:
+                # Newer check (other Input)
+                self.deadlines.update(
+                    doc['_id'], source['freshness'] / 1000.0,
+                    keys[doc['_id']])
+                continue
+            if source['output'].startswith(prefix):
+                continue
+
+            hit = {
+                '_index': doc['_index'], '_type': doc['_type'],
+                '_id': doc['_id'], '_version': doc['_version'],
+                '_source': source,
+            }
+            if doc['_type'] == 'service':
+                hit['_parent'] = source['hostname']
+            logs.append(self._outdate(hit, outdated_status, prefix))
+            hits.append(hit)
+
+        if not hits:
+            return
+
+        outdated = 0
+        try:
+            for hit, log, (ok, item) in zip(
+                hits, logs, helpers.streaming_bulk(
+                    self.elasticclient, hits, chunk_size=self.batch_size,
+                    raise_on_error=False,
+                )
+            ):
+                if ok:
+                    # Conflicts are updated documents
+                    self.logs.append(log)
+                    self._outdated_state(hit['_type'], log)
+                    outdated += 1
+        except:
+            self._throttle_error(
+                self.log, "ElasticsearchBackend: failed to update outdated")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+            self._retry_expired(expired)
+
+        if self.registry is not None:
+            self.registry.inc('freshness_outdated', outdated)
+        self._send_outdated_states()
+        self._send_to_logs()
+
+    def _retry_expired(self, expired):
+        """
+        Outdate checks again later (backend failing)
+        """
+        deadline = time.time() + FRESHNESS_RETRY
+        for check_id, previous, key in expired:
+            self.deadlines.update(check_id, deadline, key)
+
+    def _pop_batch(self):
+        """
+        Pop batch_size checks (by id, with coalesced versions)
+        """
+        batch = []
+        while len(batch) <= self.batch_size:
             if len(self.checks) == 0:
                 break
 
             check = self.checks.pop(0)
+            batch.append(self.pending.pop(check.id))
+        return batch
+
+    def status_iterator(self, batch, slot, cached):
+        """
+        Iterate over batch checks, yielding to update it
+        Checks got from slot cache are stored in cached (by id)
+        """
+        body = []
+        docs = []
+        checks = []
+        compacted = 0
+        for versions in batch:
+            check = versions[0]
 
             metadata = {"_type": check.type, "_id": check.id}
             if check.type == 'service':
                 metadata['_parent'] = check.hostname
 
-            body.append(metadata)
-            checks.append(check)
+            checks.append(versions)
 
-        # Get previous status and ack to make decisions
-        self.elasticclient.indices.refresh(
-            index=self.status_index, ignore_unavailable=True)
+            entry = None
+            if slot.cache is not None:
+                entry = slot.cache.get(check.id)
 
-        res = self.elasticclient.mget(
-            body=json.dumps({"docs": body}),
-            index=self.status_index,
-            _source_include=('status', 'ack', 'timestamp'),
-            refresh=True,
-        )
+            if entry is None:
+                # Get it from cluster
+                body.append(metadata)
+                docs.append(None)
+            else:
+                # Same as a found mget document
+                metadata['_index'] = self.status_index
+                metadata['found'] = True
+                metadata['_source'] = {
+                    'status': entry[0], 'timestamp': entry[1],
+                    'freshness': entry[2], 'last_check': entry[3],
+                    'digest': entry[4]}
+                docs.append(metadata)
+                cached[check.id] = versions[-1]
 
-        for doc in res['docs']:
-            check = checks.pop(0)
+        if body:
+            # Get previous status and ack to make decisions
+            self.elasticclient.indices.refresh(
+                index=self.status_index, ignore_unavailable=True)
+
+            fields = ('status', 'ack', 'timestamp', 'last_check')
+            if self.compaction:
+                fields += ('freshness', 'output', 'contacts')
+            res = self.elasticclient.mget(
+                body=codec.dumps({"docs": body}),
+                index=self.status_index,
+                _source_include=fields,
+                refresh=True,
+            )
+
+            fetched = iter(res['docs'])
+            docs = [doc or next(fetched) for doc in docs]
+
+            if self.compaction:
+                for doc in res['docs']:
+                    source = doc.get('_source')
+                    if source is not None and 'output' in source:
+                        source['digest'] = self._digest(
+                            source['output'], source.get('contacts'))
+
+        for doc in docs:
+            versions = checks.pop(0)
+            # Newest check is written, others only logged (transitions)
+            check = versions[-1]
 
             if 'found' in doc and doc['found'] is True:
-                # Do not erase previous checks with old data
-                if (check.timestamp * 1000) < doc['_source']['timestamp']:
+                # Do not erase previous checks with old data (replayed
+                # spool), nor log transitions older than last check
+                last_check = doc['_source'].get(
+                    'last_check', doc['_source']['timestamp'])
+                if (check.timestamp * 1000) < last_check:
                     continue
 
                 doc['doc'] = {}
@@ -194,20 +834,41 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
                 doc['doc']['check'] = check.check
                 doc['doc']['hostname'] = check.hostname
 
-                if check.status != doc['_source']['status']:
+                changed = self._transitions(
+                    versions, doc['_source']['status'], last_check,
+                    slot.logs)
+                if changed is None and \
+                   self._compacted(check, doc['_source']):
+                    # Heartbeat, document refreshed later
+                    compacted += 1
+                    stored = doc['_source']
+                    if slot.cache is not None and 'freshness' in stored:
+                        slot.cache.set(
+                            check.id, stored['status'], stored['timestamp'],
+                            stored['freshness'],
+                            stored.get('last_check', stored['timestamp']),
+                            stored['digest'])
+                    continue
+                if changed is not None:
+                    doc['doc']['status'] = changed.status
+                    doc['doc']['timestamp'] = changed.timestamp * 1000
+                    doc['doc']['ack'] = 0
+                    self._service_state(slot, check, changed.status)
+                elif check.id in cached:
+                    # Heal status if cache was wrong
                     doc['doc']['status'] = check.status
-                    doc['doc']['timestamp'] = check.timestamp * 1000
 
-                    # Add a log entry of this change (no ack / last_check)
-                    log = {}
-                    for f in check.log_fields:
-                        log[f] = doc['doc'][f]
-                    self.logs.append(log)
-
-                    doc['doc']['ack'] = 0
+                if slot.cache is not None:
+                    slot.cache.set(
+                        check.id,
+                        doc['doc'].get('status', doc['_source']['status']),
+                        doc['doc'].get(
+                            'timestamp', doc['_source']['timestamp']),
+                        check.freshness * 1000, check.timestamp * 1000,
+                        self._digest(check.output, check.contacts))
 
                 del doc['_source']
-                del doc['_version']
+                doc.pop('_version', None)
                 doc['doc']['last_check'] = check.timestamp * 1000
                 doc['doc']['freshness'] = check.freshness * 1000
 
@@ -218,51 +879,568 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
                 if check.type == 'service':
                     doc['_parent'] = check.hostname
 
-                for slot in check.fields:
-                    if slot in ("timestamp", "freshness"):
-                        doc['_source'][slot] = getattr(
-                            check, slot, None) * 1000
+                for field in check.fields:
+                    if field in ("timestamp", "freshness"):
+                        doc['_source'][field] = getattr(
+                            check, field, None) * 1000
                     else:
-                        doc['_source'][slot] = getattr(check, slot, None)
+                        doc['_source'][field] = getattr(check, field, None)
+
+                # Transitions after first check
+                changed = self._transitions(
+                    versions[1:], versions[0].status, 0, slot.logs)
+                if changed is not None:
+                    doc['_source']['timestamp'] = changed.timestamp * 1000
+                self._service_state(slot, check, check.status)
+
+                if slot.cache is not None:
+                    slot.cache.set(
+                        check.id, doc['_source']['status'],
+                        doc['_source']['timestamp'],
+                        doc['_source']['freshness'], check.timestamp * 1000,
+                        self._digest(check.output, check.contacts))
 
             yield doc
 
-    def _send_to_status(self):
+        if compacted and self.registry is not None:
+            self.registry.inc('backend_compacted', compacted)
+
+    def _compacted(self, check, stored):
+        """
+        Heartbeat compaction : True if unchanged check write is skipped
+        Stored document last_check is refreshed once compaction part of
+        freshness window elapsed, output changes after output_interval
+        """
+        if not self.compaction or stored.get('digest') is None:
+            return False
+        last_check = stored.get('last_check', stored.get('timestamp'))
+        if last_check is None:
+            return False
+
+        elapsed = check.timestamp * 1000 - last_check
+        window = (check.freshness - check.timestamp) * 1000
+        if elapsed >= self.compaction * window:
+            return False
+        if stored['digest'] != self._digest(check.output, check.contacts):
+            return elapsed < self.output_interval * 1000
+        return True
+
+    @staticmethod
+    def _digest(output, contacts):
+        """
+        Output and contacts hash (heartbeat compaction)
+        """
+        if isinstance(contacts, list):
+            contacts = tuple(contacts)
+        return hash((output, contacts))
+
+    def script_iterator(self, batch, scripted):
+        """
+        Iterate over batch checks, yielding scripted updates (with upsert)
+        Checks are stored in scripted (by id) to handle responses
+        """
+        for versions in batch:
+            check = versions[-1]
+            scripted[check.id] = versions
+
+            doc = {
+                '_op_type': 'update',
+                '_index': self.status_index,
+                '_type': check.type,
+                '_id': check.id,
+                'fields': STATUS_SCRIPT_FIELDS,
+            }
+            if check.type == 'service':
+                doc['_parent'] = check.hostname
+
+            doc['script'] = {
+                'inline': STATUS_SCRIPT,
+                'lang': 'groovy',
+                'params': {
+                    'timestamp': check.timestamp * 1000,
+                    'refresh': self.compaction * 1000 * (
+                        check.freshness - check.timestamp),
+                    'output_interval': self.output_interval * 1000,
+                    'transitions': [
+                        [version.timestamp * 1000, version.status]
+                        for version in versions],
+                    'values': {
+                        'output': check.output,
+                        'contacts': check.contacts,
+                        'check': check.check,
+                        'hostname': check.hostname,
+                        'last_check': check.timestamp * 1000,
+                        'freshness': check.freshness * 1000,
+                    },
+                },
+            }
+
+            # Same as a create (transitions after first check)
+            doc['upsert'] = {}
+            for slot in check.fields:
+                if slot in ("timestamp", "freshness"):
+                    doc['upsert'][slot] = getattr(check, slot, None) * 1000
+                else:
+                    doc['upsert'][slot] = getattr(check, slot, None)
+
+            status = versions[0].status
+            for version in versions[1:]:
+                if version.status != status:
+                    status = version.status
+                    doc['upsert']['timestamp'] = version.timestamp * 1000
+
+            yield doc
+
+    @staticmethod
+    def _expand_action(data):
+        """
+        Bulk action expand, with update fields to return
+        """
+        fields = data.pop('fields', None)
+        action, body = helpers.expand_action(data)
+        if fields:
+            action['update']['fields'] = fields
+        return action, body
+
+    def _transitions(self, versions, status, timestamp, logs):
+        """
+        Add a log entry for each status change (no ack / last_check)
+        Versions older than timestamp (ms) are ignored
+        Return last changing check
+        """
+        changed = None
+        for version in versions:
+            if (version.timestamp * 1000) < timestamp:
+                continue
+            if version.status != status:
+                status = version.status
+                changed = version
+
+                log = {}
+                for f in version.log_fields:
+                    log[f] = getattr(version, f)
+                log['timestamp'] = version.timestamp * 1000
+                logs.append(log)
+        return changed
+
+    def _send_to_status(self, batch, slot):
+        """
+        Send batch to status index
+        """
+        slot.states = {}
+        slot.hosts = set()
+        if self.scripted:
+            self._send_to_status_scripted(batch, slot)
+        elif slot.cache is None:
+            for res in helpers.streaming_bulk(
+                self.elasticclient,
+                self.status_iterator(batch, slot, {}),
+                chunk_size=self.batch_size,
+            ):
+                # Errors are already raised by bulk
+                pass
+        else:
+            self._send_to_status_cached(batch, slot)
+        slot.acked = time.time()
+
+        if self.service_states:
+            self._send_service_states(slot.states, slot.hosts)
+
+        # Trigger logs update
+        self._send_to_logs(slot.logs)
+
+    def _service_state(self, slot, check, status):
+        """
+        Keep a service new status for its host document (service_states)
+        Status change resets acknowledgement
+        """
+        if not self.service_states:
+            return
+        if check.type == 'host':
+            slot.hosts.add(check.hostname)
+        else:
+            slot.states.setdefault(check.hostname, {})[check.check] = {
+                'status': status, 'ack': 0}
+
+    def _outdated_state(self, kind, log):
+        """
+        Keep an outdated service status for its host document
+        (service_states), acknowledgement kept as on service document
+        """
+        if not self.service_states or kind != 'service':
+            return
+        self.outdated_states.setdefault(log['hostname'], {})[
+            log['check']] = {'status': log['status']}
+
+    def _send_outdated_states(self):
+        """
+        Update services states of host documents (after freshness pass)
+        """
+        states, self.outdated_states = self.outdated_states, {}
+        self._send_service_states(states)
+
+    def _send_service_states(self, states, hosts=()):
+        """
+        Update services states of host documents (after status bulk, or
+        freshness pass)
+        Created hosts get states of their services already stored, other
+        missing hosts are skipped (states set on host creation)
+        """
+        if not states and not hosts:
+            return
+
+        errors = 0
+        try:
+            if hosts:
+                self.elasticclient.indices.refresh(
+                    index=self.status_index, ignore_unavailable=True)
+                for hit in helpers.scan(
+                    self.elasticclient,
+                    index=self.status_index,
+                    doc_type='service',
+                    size=self.batch_size,
+                    query=codec.dumps({
+                        'query': {'terms': {'hostname': list(hosts)}},
+                        '_source': [
+                            'hostname', 'check', 'status', 'ack',
+                            'downtime'],
+                    }),
+                    scroll='60s',
+                ):
+                    source = hit['_source']
+                    services = states.setdefault(source['hostname'], {})
+                    services[source['check']] = {
+                        'status': source['status'],
+                        'ack': source.get('ack') or 0,
+                        'downtime': source.get('downtime') or 0}
+
+            for ok, item in helpers.streaming_bulk(
+                self.elasticclient,
+                (
+                    {
+                        '_op_type': 'update',
+                        '_index': self.status_index,
+                        '_type': 'host',
+                        '_id': hostname,
+                        '_retry_on_conflict': SERVICE_STATES_RETRIES,
+                        'doc': {'service_states': services},
+                    }
+                    for hostname, services in states.items()
+                ),
+                chunk_size=self.batch_size,
+                raise_on_error=False,
+            ):
+                op_type, info = item.popitem()
+                if not ok and info.get('status') != 404:
+                    errors += 1
+        except:
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: failed to update services states")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+
+        if errors:
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: %d services states updates failed" %
+                errors)
+
+    def rebuild(self):
+        """
+        Rebuild host documents service_states from services documents
+        (lost updates, option enabled on stored checks)
+        """
+        if not self.service_states:
+            return None
+        if not self._connect():
+            self._throttle_error(
+                self.log, "ElasticsearchBackend: not connected, "
+                "services states not rebuilt")
+            return REBUILD_RETRY
+
+        self.elasticclient.indices.refresh(
+            index=self.status_index, ignore_unavailable=True)
+
+        states = {}
+        for hit in helpers.scan(
+            self.elasticclient,
+            index=self.status_index,
+            doc_type='service',
+            size=self.batch_size,
+            query=codec.dumps({'_source': [
+                'hostname', 'check', 'status', 'ack', 'downtime']}),
+            scroll='60s',
+        ):
+            source = hit['_source']
+            states.setdefault(source['hostname'], {})[source['check']] = {
+                'status': source['status'],
+                'ack': source.get('ack') or 0,
+                'downtime': source.get('downtime') or 0}
+
+        updated = 0
+        errors = 0
+        for ok, item in helpers.streaming_bulk(
+            self.elasticclient,
+            self._rebuilt_states(states),
+            chunk_size=self.batch_size,
+            raise_on_error=False,
+        ):
+            op_type, info = item.popitem()
+            if ok:
+                updated += 1
+            elif info.get('status') != 404:
+                errors += 1
+
+        if errors:
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: %d services states rebuilds failed" %
+                errors)
+        self.log.info(
+            "ElasticsearchBackend: services states rebuilt (%d hosts "
+            "updated)" % updated)
+        return self.rebuild_interval or None
+
+    def _rebuilt_states(self, states):
+        """
+        Host documents updates of differing services states (dropped
+        services set to None)
+        """
+        def normalize(state):
+            if not state or state.get('status') is None:
+                return None
+            return {
+                'status': state['status'],
+                'ack': state.get('ack') or 0,
+                'downtime': state.get('downtime') or 0}
+
+        for hit in helpers.scan(
+            self.elasticclient,
+            index=self.status_index,
+            doc_type='host',
+            size=self.batch_size,
+            query=codec.dumps({'_source': ['service_states']}),
+            scroll='60s',
+        ):
+            stored = hit['_source'].get('service_states') or {}
+            rebuilt = states.get(hit['_id'], {})
+            changed = {}
+            for check in set(stored) | set(rebuilt):
+                state = rebuilt.get(check)
+                if normalize(stored.get(check)) != state:
+                    changed[check] = state
+            if not changed:
+                continue
+
+            yield {
+                '_op_type': 'update',
+                '_index': self.status_index,
+                '_type': 'host',
+                '_id': hit['_id'],
+                '_retry_on_conflict': SERVICE_STATES_RETRIES,
+                'doc': {'service_states': changed},
+            }
+
+    def _send_to_status_cached(self, batch, slot):
         """
-        Send batch_size checks to status index
+        Send to status index, keeping cache consistent
+        Checks of dropped documents (cache hit, update fail) are queued back
         """
-        for res in helpers.streaming_bulk(
+        errors = 0
+        cached = {}
+        try:
+            for ok, item in helpers.streaming_bulk(
+                self.elasticclient,
+                self.status_iterator(batch, slot, cached),
+                chunk_size=self.batch_size,
+                raise_on_error=False,
+            ):
+                if ok:
+                    continue
+
+                op_type, info = item.popitem()
+                slot.cache.evict(info['_id'])
+                if info.get('status') == 429:
+                    slot.rejected += 1
+
+                if info.get('status') == 404 and info['_id'] in cached:
+                    self._requeue(cached[info['_id']])
+                else:
+                    errors += 1
+        except:
+            # Unknown state of documents
+            slot.cache.clear()
+            raise
+
+        if errors:
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: %d status updates failed" % errors)
+
+    def _send_to_status_scripted(self, batch, slot):
+        """
+        Send scripted updates to status index
+        Log transitions from bulk response (previous status returned)
+        Checks of failed updates are queued back
+        """
+        errors = 0
+        scripted = {}
+        for ok, item in helpers.streaming_bulk(
             self.elasticclient,
-            self.status_iterator(),
+            self.script_iterator(batch, scripted),
             chunk_size=self.batch_size,
+            raise_on_error=False,
+            expand_action_callback=self._expand_action,
         ):
-            # Errors are already raised by bulk
-            pass
+            op_type, info = item.popitem()
+            versions = scripted.pop(info['_id'], None)
+            if not ok or versions is None:
+                errors += 1
+                if info.get('status') == 429:
+                    slot.rejected += 1
+                if versions is not None and info.get('status') != 400:
+                    # Send it again (or spool it), invalid ones dropped
+                    for check in versions:
+                        self._requeue(check)
+                continue
 
-        # Trigger logs update
-        self._send_to_logs()
+            if info.get('status') == 201:
+                # Created (upsert)
+                self._transitions(
+                    versions[1:], versions[0].status, 0, slot.logs)
+                self._service_state(slot, versions[-1], versions[-1].status)
+                continue
+
+            fields = info.get('get', {}).get('fields', {})
+            if 'previous_status' not in fields:
+                continue
 
-    def _send_to_logs(self):
-        body = ""
-        while len(self.logs) > 0:
-            log = self.logs.pop(0)
+            # Not updated (older check)
+            last_check = fields.get('last_check', fields['timestamp'])[0]
+            if last_check > versions[-1].timestamp * 1000:
+                continue
 
-            index = self.get_log_index(int(log['timestamp'] / 1000))
+            changed = self._transitions(
+                versions, fields['previous_status'][0],
+                fields.get(
+                    'previous_last_check', fields['previous_timestamp'])[0],
+                slot.logs)
+            if changed is not None:
+                self._service_state(slot, versions[-1], changed.status)
 
-            # Request metadata
-            body += json.dumps({
+        if errors:
+            self._throttle_error(
+                self.log,
+                "ElasticsearchBackend: %d status updates failed" % errors)
+
+    def _slot(self, check_id):
+        """
+        Slot handling a check id
+        """
+        return self.slots[hash(check_id) % self.concurrency]
+
+    def _load_cache(self):
+        """
+        Fill status caches (one scroll) on startup
+        Not retried on failure (filled by checks anyway)
+        """
+        self.cache_loaded = True
+        size = sum(slot.cache.size for slot in self.slots)
+        loaded = 0
+        fields = ['status', 'timestamp', 'freshness']
+        if self.compaction:
+            fields += ['last_check', 'output', 'contacts']
+        try:
+            for hit in helpers.scan(
+                self.elasticclient,
+                index=self.status_index,
+                size=self.batch_size,
+                query=codec.dumps({'_source': fields}),
+                scroll='60s',
+            ):
+                if loaded >= size:
+                    break
+                source = hit['_source']
+                cache = self._slot(hit['_id']).cache
+                if 'freshness' not in source or cache.full():
+                    continue
+                digest = None
+                if self.compaction:
+                    digest = self._digest(
+                        source.get('output'), source.get('contacts'))
+                cache.set(
+                    hit['_id'], source['status'], source['timestamp'],
+                    source['freshness'],
+                    source.get('last_check', source['timestamp']), digest)
+                loaded += 1
+        except:
+            self.log.info("ElasticsearchBackend: failed to load status cache")
+            self.log.debug("Trace:\n%s" % traceback.format_exc())
+            for slot in self.slots:
+                slot.cache.clear()
+            return
+
+        self.log.info(
+            "ElasticsearchBackend: status cache loaded (%d documents)" %
+            loaded)
+
+    def _log_action(self, timestamp):
+        """
+        Encoded bulk action line of a log (timestamp in ms)
+        Index name is computed once by LOG_INDEX_BUCKET
+        """
+        bucket = int(timestamp / 1000) // LOG_INDEX_BUCKET
+        action = self.log_actions.get(bucket)
+        if action is None:
+            if len(self.log_actions) >= 1000:
+                self.log_actions.clear()
+            index = self.get_log_index(bucket * LOG_INDEX_BUCKET)
+            action = codec.dumps({
                 "index": {"_type": "event", "_index": index}})
-            body += "\n"
+            self.log_actions[bucket] = action
+        return action
+
+    def logs_iterator(self, logs):
+        """
+        Yield bulk lines of logs (action, document)
+        """
+        for log in logs:
+            yield self._log_action(log['timestamp'])
+            yield codec.dumps(log)
 
-            # Request document
-            body += json.dumps(log)
-            body += "\n"
+    def _send_to_logs(self, logs=None):
+        if logs is None:
+            logs = self.logs
 
-        if body != "":
-            res = self.elasticclient.bulk(body=body)
+        # Take all pending logs
+        events = logs[:]
+        del logs[:len(events)]
+        if not events:
+            return
+
+        lines = self.logs_iterator(events)
+        failed = 0
+        error = None
+        while True:
+            chunk = list(itertools.islice(lines, 2 * LOGS_CHUNK))
+            if not chunk:
+                break
+
+            chunk.append('')
+            res = self.elasticclient.bulk(body='\n'.join(chunk))
+
+            if not res.get('errors'):
+                continue
+            for item in res['items']:
+                info = list(item.values())[0]
+                if not 200 <= info.get('status', 500) < 300:
+                    failed += 1
+                    error = info.get('error', error)
 
-            if 'errors' in res and res['errors'] != 0:
-                self.log.warn("ElasticsearchBackend: log_send error found")
+        if failed:
+            self.log.warn(
+                "ElasticsearchBackend: log_send error found "
+                "(%d failed on %d, %s)" % (failed, len(events), error))
 
     def send(self):
         """
@@ -271,28 +1449,261 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
         if not self._connect():
             self._throttle_error(
                 self.log, "ElasticsearchBackend: not connected, queuing")
+            self.healthy = False
+            if self.spool is not None:
+                self._trim(self.backlog_size)
+            if self.registry is not None:
+                self._gauges()
             return
 
+        if not self.cache_loaded:
+            self._load_cache()
+
+        # Replay when idle too (probing cluster once unhealthy)
+        if self.spool is not None and (self.healthy or not self.checks):
+            self._replay()
+
+        if self.measures:
+            self._adapt_slots()
+
+        # Checks queued back by slots
+        if self.requeued:
+            with self.requeue_lock:
+                requeued = self.requeued
+                self.requeued = []
+            for check in requeued:
+                self._queue(check)
+
+        try:
+            batch = self._pop_batch()
+            if not batch:
+                pass
+            elif self.concurrency == 1:
+                self._send_batch(batch, self.slots[0])
+            else:
+                self._dispatch(batch)
+
+        finally:
+            # Trim
+            if len(self.checks) > self.backlog_size:
+                trim_offset = (self.backlog_size * -1 + self.batch_size)
+                if self.spool is not None:
+                    self._trim(abs(trim_offset))
+                else:
+                    self.log.warn(
+                        "ElasticsearchBackend: trimming backlog "
+                        "(keep %d on %d)" % (
+                            abs(trim_offset), len(self.checks)))
+                    for check in self.checks[:trim_offset]:
+                        del self.pending[check.id]
+                    self.checks = self.checks[trim_offset:]
+
+            if self.registry is not None:
+                self._gauges()
+
+    def spooled(self):
+        """
+        Checks waiting in disk spool
+        """
+        return self.spool is not None and not self.spool.empty()
+
+    def _gauges(self):
+        """
+        Update backend gauges in metrics registry
+        """
+        self.registry.set('backend_pending', len(self.checks))
+        self.registry.set('backend_batch_size', self.batch_size)
+        self.registry.set('backend_ttl', self.ttl or 0)
+        if self.spool is not None:
+            self.registry.set('backend_spool_bytes', self.spool.size())
+
+    def _trim(self, keep):
+        """
+        Move oldest checks to spool, keeping keep checks ids in memory
+        """
+        overflow = len(self.checks) - keep
+        if overflow <= 0:
+            return
+
+        checks = []
+        for check in self.checks[:overflow]:
+            checks.extend(self.pending.pop(check.id))
+        self.checks = self.checks[overflow:]
+
+        try:
+            self.spool.append(checks)
+        except:
+            self.log.error(
+                "ElasticsearchBackend: failed to spool %d checks" %
+                len(checks))
+            self.log.debug("Trace :\n%s" % traceback.format_exc())
+            return
+
+        self._throttle_error(self.log, "ElasticsearchBackend: spooling checks")
+        self.log.debug(
+            "ElasticsearchBackend: %d checks spooled (%d bytes in spool)" % (
+                len(checks), self.spool.size()))
+
+    def _replay(self):
+        """
+        Get back spooled checks (replay_rate checks per second, one
+        second allowance at most)
+        """
+        now = time.time()
+        self.replay_allowance = min(
+            self.replay_rate,
+            self.replay_allowance + (now - self.replay_ts) * self.replay_rate)
+        self.replay_ts = now
+
+        count = int(self.replay_allowance) - len(self.checks)
+        if count <= 0 or self.spool.empty():
+            return
+
+        checks = self.spool.read(count)
+        self.replay_allowance -= len(checks)
+        for check in checks:
+            self._queue(check)
+
+        if self.spool.empty():
+            self.log.info("ElasticsearchBackend: spool replayed")
+
+    def _send_batch(self, batch, slot):
+        """
+        Send a batch (in slot), errors are logged
+        """
+        start = time.time()
+        slot.rejected = 0
         try:
             # Send to status
-            self._send_to_status()
+            self._send_to_status(batch, slot)
             # Send to logs
-            if len(self.logs) > 0:
-                self._send_to_logs()
+            if len(slot.logs) > 0:
+                self._send_to_logs(slot.logs)
             else:
                 self.log.debug('ElasticsearchBackend: no events to send')
 
-        except Exception:
+            self.healthy = True
+
+            if self.trace is not None:
+                self._trace(batch, start, slot.acked)
+            if self.registry is not None:
+                self.registry.inc(
+                    'backend_bulk_checks',
+                    sum(len(versions) for versions in batch))
+
+        except Exception as e:
             self._throttle_error(
                 self.log,
                 "ElasticsearchBackend: uncatched error sending checks")
             self.log.debug("Trace :\n%s" % traceback.format_exc())
+            self.healthy = False
+            slot.rejected += self._rejected(e, len(batch))
+            if self.registry is not None:
+                self.registry.inc('backend_bulk_errors')
 
-        finally:
-            # Trim
-            if len(self.checks) > self.backlog_size:
-                trim_offset = (self.backlog_size * -1 + self.batch_size)
-                self.log.warn(
-                    "ElasticsearchBackend: trimming backlog (keep %d on %d)" %
-                    len(self.checks) - abs(trim_offset), abs(trim_offset))
-                self.checks = self.checks[trim_offset:]
+            if self.spool is not None:
+                # Send it again or spool it
+                for versions in batch:
+                    for check in versions:
+                        self._requeue(check)
+
+        slot.record(time.time() - start, len(batch), self.log)
+        if self.registry is not None:
+            self.registry.observe('backend_bulk_latency', time.time() - start)
+            if slot.rejected:
+                self.registry.inc('backend_rejected', slot.rejected)
+
+        if self.controller is None:
+            pass
+        elif self.concurrency == 1:
+            self._adapt(time.time() - start, slot.rejected)
+        else:
+            with self.measure_lock:
+                self.measures.append((time.time() - start, slot.rejected))
+
+    def _trace(self, batch, sent, acked):
+        """
+        Account sent checks latency (backend stages and end to end)
+        """
+        now = time.time()
+        checks = [check for versions in batch for check in versions]
+        self.trace.add('pending', [
+            sent - check.join_ts for check in checks if check.join_ts])
+        self.trace.add_same('bulk', acked - sent, len(checks))
+        self.trace.add_same('logs', now - acked, len(checks))
+        self.trace.add('total', [
+            acked - check.read_ts for check in checks if check.read_ts])
+        self.trace.add('lag', [acked - check.timestamp for check in checks])
+
+    def _rejected(self, e, checks):
+        """
+        Count checks rejected by cluster (HTTP 429) from a bulk exception
+        """
+        if getattr(e, 'status_code', None) == 429:
+            return checks
+        if isinstance(e, helpers.BulkIndexError):
+            return len([
+                error for error in e.errors
+                if list(error.values())[0].get('status') == 429])
+        return 0
+
+    def _adapt(self, rtt, rejected):
+        """
+        Update batch size and flush delay from bulk measures
+        """
+        self.controller.sent(rtt, self.arrivals, rejected)
+        self.batch_size = self.controller.batch
+        self.ttl = self.controller.ttl
+
+        if time.time() - self.controller_ts >= SLOT_REPORT_INTERVAL:
+            self.controller_ts = time.time()
+            self.log.info(
+                "ElasticsearchBackend: adaptive batch %(batch)d, "
+                "ttl %(ttl).3fs (rate %(rate).1f/s, rtt %(rtt).3fs, "
+                "rejections %(rejections)d)" % self.controller.report())
+
+    def _adapt_slots(self):
+        """
+        Adapt once on slots bulks sent since last send (concurrent ones) :
+        slowest round trip, all rejected checks
+        """
+        with self.measure_lock:
+            measures = self.measures
+            self.measures = []
+
+        self._adapt(
+            max(rtt for rtt, rejected in measures),
+            sum(rejected for rtt, rejected in measures))
+
+    def _dispatch(self, batch):
+        """
+        Partition batch by slot, queue it to slots threads
+        Block while slot have a batch waiting (in-flight one plus one)
+        """
+        parts = [[] for slot in self.slots]
+        for versions in batch:
+            parts[hash(versions[0].id) % self.concurrency].append(versions)
+
+        for slot, part in zip(self.slots, parts):
+            if not part:
+                continue
+
+            if slot.thread is None:
+                slot.queue = Queue(maxsize=1)
+                slot.thread = threading.Thread(
+                    target=self._slot_thread, args=(slot,))
+                slot.thread.daemon = True
+                slot.thread.start()
+
+            slot.queue.put(part)
+
+    def _slot_thread(self, slot):
+        """
+        Send slot batches, in order
+        """
+        while True:
+            batch = slot.queue.get()
+            try:
+                self._send_batch(batch, slot)
+            finally:
+                slot.queue.task_done()
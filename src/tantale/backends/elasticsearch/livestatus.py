@@ -2,13 +2,15 @@
 
 from __future__ import print_function
 
-import json
 import copy
 import time
 import logging
 
+from tantale import codec
 from tantale.backends.elasticsearch.base import ElasticsearchBaseBackend
+from tantale.backends.elasticsearch.base import SERVICE_STATES_RETRIES
 from tantale.livestatus.backend import Backend
+from tantale.utils import str_to_bool
 
 
 class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
@@ -16,6 +18,9 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
         self.log = logging.getLogger('tantale.livestatus')
         super(ElasticsearchBackend, self).__init__(config)
 
+        # Services states kept in host documents (num_services_* columns)
+        self.service_states = str_to_bool(self.config['service_states'])
+
     def _convert_expr(self, field, operator, value=None):
         """ Convert tantale expression to elasticsearch filter """
         # Handle booleans (and/or/not)
@@ -112,11 +117,12 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
                 value = None
 
             self._update_query(
-                body=json.dumps({"doc": {"ack": value}}),
+                body=codec.dumps({"doc": {"ack": value}}),
                 doc_type=command.type,
                 id=command.doc_id,
                 parent=command.parent
             )
+            self._service_state(command, {'ack': value or 0})
 
         elif command.function == 'downtime':
             query = {'doc': {}}
@@ -125,7 +131,7 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
                 # Generate unique id
                 res = self.elasticclient.search(
                     index=self.status_index, size=0,
-                    body=json.dumps({
+                    body=codec.dumps({
                         "aggs": {"uid": {"max": {"field": "downtime_id"}}}
                     })
                 )
@@ -146,11 +152,11 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
                 kwargs = {
                     'index': self.status_index,
                     'size': 1,
-                    'body': json.dumps(id_search),
+                    'body': codec.dumps(id_search),
                 }
                 res = self.elasticclient.search(
                     index=self.status_index,
-                    body=json.dumps({
+                    body=codec.dumps({
                         'filter': {'term': {'downtime_id': command.doc_id}}})
                 )
 
@@ -161,16 +167,21 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
                 command.type = res['hits']['hits'][0]['_type']
                 if '_parent' in res['hits']['hits'][0]:
                     command.parent = res['hits']['hits'][0]['_parent']
+                elif command.type == 'service':
+                    command.parent = \
+                        res['hits']['hits'][0]['_source']['hostname']
 
                 query['doc']['downtime_id'] = None
                 query['doc']['downtime'] = None
 
             self._update_query(
-                body=json.dumps(query),
+                body=codec.dumps(query),
                 doc_type=command.type,
                 id=command.doc_id,
                 parent=command.parent
             )
+            self._service_state(
+                command, {'downtime': query['doc']['downtime'] or 0})
 
         elif command.function == 'drop':
             self._delete_query(
@@ -178,6 +189,25 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
                 id=command.doc_id,
                 parent=command.parent
             )
+            self._service_state(command, None)
+
+    def _service_state(self, command, state):
+        """
+        Reflect a service command in its host document (service_states)
+        None state drops the service
+        """
+        if not self.service_states or command.type != 'service' or \
+           not command.parent:
+            return
+
+        check = command.doc_id[len(command.parent) + 1:]
+        self._update_query(
+            body=codec.dumps({"doc": {"service_states": {check: state}}}),
+            doc_type='host',
+            id=command.parent,
+            retry_on_conflict=SERVICE_STATES_RETRIES,
+            ignore=404
+        )
 
     def _delete_query(self, **kwargs):
         if 'parent' in kwargs and kwargs['parent'] is None:
@@ -227,7 +257,8 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
         if qtype is not None:
             es_meta = {"index": self.status_index, 'type': qtype}
         else:
-            es_meta = {"index": self.status_index}
+            # Not freshness leases
+            es_meta = {"index": self.status_index, 'type': 'host,service'}
         return self._search_query(query, es_meta)
 
     def logs_query(self, query):
@@ -253,12 +284,12 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
             es_meta['search_type'] = 'count'
             body = ""
             for stat in query.stats:
-                body += json.dumps(es_meta) + "\n"
+                body += codec.dumps(es_meta) + "\n"
                 stat_query = copy.deepcopy(es_query)
                 stat_query['filter']['and'].append(self._convert_expr(*stat))
                 self.log.debug(
                     'Elasticsearch count request : %s' % stat_query)
-                body += json.dumps(stat_query) + "\n"
+                body += codec.dumps(stat_query) + "\n"
 
             result = []
             for response in self.elasticclient.msearch(body=body)['responses']:
@@ -279,8 +310,8 @@ class ElasticsearchBackend(ElasticsearchBaseBackend, Backend):
 
             self.log.debug('Elasticsearch search request : %s' % es_query)
 
-            body = json.dumps(es_meta) + "\n"
-            body += json.dumps(es_query) + "\n"
+            body = codec.dumps(es_meta) + "\n"
+            body += codec.dumps(es_query) + "\n"
 
             response = self.elasticclient.msearch(body=body)['responses'][0]
 
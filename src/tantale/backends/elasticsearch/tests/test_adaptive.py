@@ -0,0 +1,72 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.backends.elasticsearch.adaptive import BatchController
+from tantale.backends.elasticsearch.adaptive import BACKOFF, GROWTH
+
+
+class BatchControllerTC(unittest.TestCase):
+    def controller(self, batch=100):
+        # target 1s, batch 10 - 1000, ttl 0.1 - 2s
+        return BatchController(batch, 1.0, 10, 1000, 0.1, 2.0)
+
+    def sent(self, controller, rtt, arrivals, rejected=0, elapsed=1.0):
+        # Previous measure elapsed seconds ago
+        controller.ts = time.time() - elapsed
+        controller.sent(rtt, arrivals, rejected)
+
+    def test_Bounds(self):
+        self.assertEqual(self.controller(1).batch, 10)
+        self.assertEqual(self.controller(5000).batch, 1000)
+        self.assertEqual(self.controller().ttl, 2.0)
+
+    def test_Growth(self):
+        controller = self.controller()
+        # High rate, batch grows by GROWTH at most each update
+        self.sent(controller, 0.1, 100000)
+        self.assertEqual(controller.batch, int(100 * GROWTH))
+
+        for i in range(20):
+            self.sent(controller, 0.1, 100000 * (i + 2))
+        self.assertEqual(controller.batch, 1000)
+
+    def test_Shrink(self):
+        controller = self.controller(500)
+        # 20 checks / s : batch about rate * (target - rtt) = 18
+        for i in range(20):
+            self.sent(controller, 0.1, 20 * (i + 1))
+        self.assertTrue(15 <= controller.batch <= 18)
+
+        # Idle, minimum batch
+        for i in range(20):
+            self.sent(controller, 0.1, 400)
+        self.assertEqual(controller.batch, 10)
+
+    def test_Backoff(self):
+        controller = self.controller(400)
+        self.sent(controller, 0.1, 100000, rejected=5)
+        self.assertEqual(controller.batch, int(400 * BACKOFF))
+        self.assertEqual(controller.report()['rejections'], 5)
+        # Reset by report
+        self.assertEqual(controller.report()['rejections'], 0)
+
+    def test_Ttl(self):
+        controller = self.controller()
+        # Flush delay is target minus (smoothed) round trip
+        for i in range(50):
+            self.sent(controller, 0.6, 100 * (i + 1))
+        self.assertAlmostEqual(controller.ttl, 0.4, places=2)
+
+        # Round trip above target, minimum delay
+        for i in range(50):
+            self.sent(controller, 3.0, 100 * (i + 51))
+        self.assertEqual(controller.ttl, 0.1)
+        self.assertEqual(controller.batch, 10)
@@ -28,7 +28,8 @@ class ElasticsearchTC(TantaleTC):
         else:
             return 0
 
-    def push_checks(self, hosts_nb, services_per_host, delay=60):
+    def push_checks(self, hosts_nb, services_per_host, delay=60,
+                    envelope=False):
         """
         Simulate X Hosts pushing hash
         """
@@ -59,8 +60,19 @@ class ElasticsearchTC(TantaleTC):
                     "interval": 2,
                 })
 
-            for i in checks:
-                input_s.send(json.dumps(i) + "\n")
+            if envelope:
+                # One line per host, sharing host keys
+                shared = ('hostname', 'contacts', 'interval', 'timestamp')
+                line = dict((key, checks[0][key]) for key in shared)
+                line['checks'] = []
+                for check in checks:
+                    line['checks'].append(dict(
+                        (key, check[key])
+                        for key in check if key not in shared))
+                input_s.send(json.dumps(line) + "\n")
+            else:
+                for i in checks:
+                    input_s.send(json.dumps(i) + "\n")
             input_s.close()
 
     def test_Status(self):
@@ -79,7 +91,7 @@ class ElasticsearchTC(TantaleTC):
         live_s.close()
         self.stop()
 
-    def InputAndDisplay(self, bench=False, add_config=None):
+    def InputAndDisplay(self, bench=False, add_config=None, envelope=False):
         """
         Push some checks, then check they got stored
         """
@@ -105,7 +117,7 @@ class ElasticsearchTC(TantaleTC):
 
         # Input (create)
         start = time.time()
-        self.push_checks(hosts_nb, services_per_host)
+        self.push_checks(hosts_nb, services_per_host, envelope=envelope)
 
         live_s = self.getSocket('Livestatus')
 
@@ -135,6 +147,120 @@ class ElasticsearchTC(TantaleTC):
         """
         self.InputAndDisplay(self.bench)
 
+    def test_InputEnvelope(self):
+        """
+        Push checks grouped by host (envelope)
+        """
+        self.InputAndDisplay(self.bench, envelope=True)
+
+    def test_InputCoalesce(self):
+        """
+        Push a flapping check in one batch
+        Only newest is stored, but each transition is logged
+        """
+        self.InputAndDisplay()
+
+        input_s = self.getSocket('Input')
+        start = int(time.time()) - 30
+        for offset, status in enumerate((0, 2, 2, 0, 1)):
+            input_s.send(json.dumps({
+                "check": 'Host',
+                "status": status,
+                "timestamp": start + offset,
+                "contacts": ["user_1"],
+                "hostname": "flapping",
+                "output": "Flap %d" % offset,
+                "interval": 60,
+            }) + "\n")
+        input_s.close()
+
+        live_s = self.getSocket('Livestatus')
+        for nb in range(20):
+            time.sleep(0.5)
+            live_s.send(self.getLivestatusRequest('get_logs'))
+            res = live_s.recv()
+            res = [log for log in eval(res[16:]) if log[5] == 'flapping']
+            if len(res) >= 3:
+                break
+
+        self.assertEqual(len(res), 3, "Transitions not logged")
+
+        live_s.send(self.getLivestatusRequest('get_host') % 'flapping')
+        res = live_s.recv()
+        res = eval(res[16:])
+        self.assertEqual(res[0][4], "Flap 4", "Newest check not stored")
+
+    def test_InputStatusCache(self):
+        """
+        Push checks twice with status cache (second time from cache)
+        """
+        add_config = {'backends': {
+            'ElasticsearchBackend': {'status_cache_size': 1000}}}
+        self.InputAndDisplay(add_config=add_config)
+
+        self.push_checks(10, 3, delay=30)
+
+        live_s = self.getSocket('Livestatus')
+        live_s.send(self.getLivestatusRequest('get_host') % 'host_1')
+        res = live_s.recv()
+        res = eval(res[16:])
+        self.assertEqual(res[0][13], 2, "Cached host status lost")
+
+    def test_InputScripted(self):
+        """
+        Push checks twice with scripted updates (create then update)
+        """
+        add_config = {'backends': {
+            'ElasticsearchBackend': {'write_mode': 'script'}}}
+        self.InputAndDisplay(add_config=add_config)
+
+        self.push_checks(10, 3, delay=30)
+        time.sleep(1)
+
+        live_s = self.getSocket('Livestatus')
+        live_s.send(self.getLivestatusRequest('get_host') % 'host_1')
+        res = live_s.recv()
+        res = eval(res[16:])
+        self.assertEqual(res[0][13], 2, "Scripted host status lost")
+
+    def test_InputCompaction(self):
+        """
+        Push checks twice with heartbeat compaction (status changes written)
+        """
+        add_config = {'backends': {'ElasticsearchBackend': {
+            'heartbeat_compaction': 0.9, 'output_min_interval': 300}}}
+        self.InputAndDisplay(add_config=add_config)
+
+        self.push_checks(10, 3, delay=30)
+
+        live_s = self.getSocket('Livestatus')
+        live_s.send(self.getLivestatusRequest('get_host') % 'host_1')
+        res = live_s.recv()
+        res = eval(res[16:])
+        self.assertEqual(res[0][13], 2, "Compacted host status lost")
+
+    def test_InputServiceStates(self):
+        """
+        Host services counters (service_states in host documents)
+        """
+        add_config = {'backends': {
+            'ElasticsearchBackend': {'service_states': True}}}
+        self.InputAndDisplay(add_config=add_config)
+
+        live_s = self.getSocket('Livestatus')
+        for nb in range(20):
+            live_s.send(
+                self.getLivestatusRequest('get_host_services') % 'host_1')
+            res = live_s.recv()
+            res = eval(res[16:])
+            if res[0][1] == 3:
+                break
+            time.sleep(0.5)
+
+        # service_0 warning, service_1 critical, service_2 unknown
+        self.assertEqual(
+            res[0][1:], [3, 0, 1, 1, 1, 3, 2], "Host services not counted")
+
     def test_LivestatusLimit(self):
         self.InputAndDisplay()
 
@@ -256,3 +382,45 @@ class ElasticsearchTC(TantaleTC):
             print(
                 "Created then outdated those checks in %f seconds." %
                 (stop - start))
+
+    def test_InputFreshnessHeap(self):
+        """
+        Check freshness deadlines (heap mode) outdate checks
+        """
+        add_config = {"modules": {"Input": {
+            "freshness_interval": 1, "freshness_factor": 1,
+            "freshness_mode": "heap"}}}
+        self.InputAndDisplay(add_config=add_config)
+        live_s = self.getSocket('Livestatus')
+
+        # Hosts stats (loop till down hosts == total hosts)
+        for nb in range(20):
+            time.sleep(0.5)
+            live_s.send(self.getLivestatusRequest('hosts_stats'))
+            res = live_s.recv()
+            res = eval(res[16:])
+            if res[0][0] == res[0][1]:
+                break
+
+        self.assertEqual(res[0][0], res[0][1], "Checks not outdated")
+
+    def test_InputFreshnessByQuery(self):
+        """
+        Check freshness update by query outdate checks
+        """
+        add_config = {"modules": {"Input": {
+            "freshness_interval": 1, "freshness_factor": 1,
+            "freshness_mode": "update_by_query"}}}
+        self.InputAndDisplay(add_config=add_config)
+        live_s = self.getSocket('Livestatus')
+
+        # Hosts stats (loop till down hosts == total hosts)
+        for nb in range(20):
+            time.sleep(0.5)
+            live_s.send(self.getLivestatusRequest('hosts_stats'))
+            res = live_s.recv()
+            res = eval(res[16:])
+            if res[0][0] == res[0][1]:
+                break
+
+        self.assertEqual(res[0][0], res[0][1], "Checks not outdated")
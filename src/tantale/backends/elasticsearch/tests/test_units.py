@@ -0,0 +1,371 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+import logging
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.backends.elasticsearch.input import ElasticsearchBackend
+from tantale.backends.elasticsearch.input import grace_deadline
+from tantale.input.check import Check
+
+from elasticsearch import helpers
+from elasticsearch.exceptions import TransportError
+
+
+class RecordController(object):
+    """
+    BatchController recording updates
+    """
+    batch = 100
+    ttl = 1
+
+    def __init__(self):
+        self.updates = []
+
+    def sent(self, rtt, arrivals, rejected=0):
+        self.updates.append((rtt, rejected))
+
+
+class Indices(object):
+    def refresh(self, **kwargs):
+        pass
+
+
+class ScanClient(object):
+    """
+    Cluster serving scans hits by document type, recording bulk actions
+    """
+    indices = Indices()
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.actions = []
+
+    def scan(self, client, doc_type=None, **kwargs):
+        return iter(self.hits[doc_type])
+
+    def streaming_bulk(self, client, actions, **kwargs):
+        for action in actions:
+            self.actions.append(action)
+            yield True, {'update': {'status': 200}}
+
+    def bulk(self, body):
+        return {}
+
+
+class BulkSlotTC(unittest.TestCase):
+    """
+    Backend units not needing a cluster (connection fails)
+    """
+    def setUp(self):
+        logging.getLogger('elasticsearch').disabled = True
+        logging.getLogger('tantale.input').disabled = True
+        self.backend = ElasticsearchBackend({
+            'hosts': 'localhost:1', 'sniff_on_start': False,
+            'concurrency': 4})
+
+    def tearDown(self):
+        logging.getLogger('elasticsearch').disabled = False
+        logging.getLogger('tantale.input').disabled = False
+
+    def check(self, number):
+        return Check(
+            check='service_%d' % number, hostname='host', status=0,
+            timestamp=1, interval=60, freshness_factor=2)
+
+    def test_Slot(self):
+        for number in range(20):
+            check = self.check(number)
+            slot = self.backend._slot(check.id)
+            self.assertEqual(slot.number, hash(check.id) % 4)
+            # Same id, same slot (ordered versions)
+            self.assertIs(self.backend._slot(check.id), slot)
+
+    def test_Dispatch(self):
+        sent = []
+        self.backend._send_batch = lambda batch, slot: sent.extend(
+            (slot.number, versions[0].id) for versions in batch)
+
+        batch = [[self.check(number)] for number in range(20)]
+        self.backend._dispatch(batch)
+        for slot in self.backend.slots:
+            if slot.queue is not None:
+                slot.queue.join()
+
+        self.assertEqual(len(sent), 20)
+        for number, check_id in sent:
+            self.assertEqual(self.backend._slot(check_id).number, number)
+
+    def test_AdaptSlots(self):
+        # Concurrent bulks adapt controller once (slowest, all rejections)
+        self.backend.controller = RecordController()
+        self.backend.measures = [(0.1, 0), (0.3, 5), (0.2, 1)]
+        self.backend._adapt_slots()
+        self.assertEqual(self.backend.controller.updates, [(0.3, 6)])
+        self.assertEqual(self.backend.measures, [])
+
+
+class GraceTC(unittest.TestCase):
+    def test_Recent(self):
+        # Seen after start, own deadline
+        self.assertEqual(grace_deadline(
+            {'last_check': 2000, 'freshness': 5000}, 1000), 5000)
+
+    def test_Grace(self):
+        # Seen before start, one freshness delay (3000) after start
+        self.assertEqual(grace_deadline(
+            {'last_check': 2000, 'freshness': 5000}, 10000), 13000)
+        # Timestamp if never checked
+        self.assertEqual(grace_deadline(
+            {'timestamp': 2000, 'freshness': 5000}, 10000), 13000)
+
+    def test_Scan(self):
+        # Scan mode outdates checks past their grace deadline only
+        backend = ElasticsearchBackend.__new__(ElasticsearchBackend)
+        backend.logs = []
+        backend.batch_size = 10
+        backend.status_index = 'status'
+        backend.service_states = True
+        backend.outdated_states = {}
+        now = int(time.time()) * 1000
+        hits = [
+            {'_id': 'long', '_type': 'service', '_source': {
+                'hostname': 'host', 'check': 'long', 'status': 0,
+                'output': 'ok', 'timestamp': now - 10000,
+                'last_check': now - 10000, 'freshness': now - 4000}},
+            {'_id': 'short', '_type': 'service', '_source': {
+                'hostname': 'host', 'check': 'short', 'status': 0,
+                'output': 'ok', 'timestamp': now - 10000,
+                'last_check': now - 10000, 'freshness': now - 9000}},
+        ]
+        client = ScanClient({None: hits})
+        backend.elasticclient = client
+        scan = helpers.scan
+        helpers.scan = client.scan
+        try:
+            outdated = list(backend.freshness_iterator(
+                '{}', 2, 'OUTDATED - ', (now - 2000) / 1000.0, 60))
+        finally:
+            helpers.scan = scan
+
+        # Started 2s ago, grace ends at start + 6s (long), start + 1s
+        self.assertEqual([hit['_id'] for hit in outdated], ['short'])
+        # Host services states follow
+        self.assertEqual(
+            backend.outdated_states, {'host': {'short': {'status': 2}}})
+
+
+class RefusingClient(object):
+    """
+    Cluster refusing update by query (inline scripts disabled)
+    """
+    def update_by_query(self, **kwargs):
+        raise TransportError(400, 'script_exception')
+
+
+class FreshnessByQueryTC(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger('elasticsearch').disabled = True
+        logging.getLogger('tantale.input').disabled = True
+        self.backend = ElasticsearchBackend({
+            'hosts': 'localhost:1', 'sniff_on_start': False})
+
+    def tearDown(self):
+        logging.getLogger('elasticsearch').disabled = False
+        logging.getLogger('tantale.input').disabled = False
+
+    def test_Refused(self):
+        self.backend.elasticclient = RefusingClient()
+        self.backend.freshness_by_query(2, 'OUTDATED - ', time.time())
+        self.assertEqual(self.backend.logs, [])
+
+
+class ServiceStatesTC(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger('elasticsearch').disabled = True
+        logging.getLogger('tantale.input').disabled = True
+        self.backend = ElasticsearchBackend({
+            'hosts': 'localhost:1', 'sniff_on_start': False,
+            'service_states': True})
+
+    def tearDown(self):
+        logging.getLogger('elasticsearch').disabled = False
+        logging.getLogger('tantale.input').disabled = False
+
+    def test_Rebuild(self):
+        client = ScanClient({
+            'service': [
+                {'_source': {'hostname': 'a', 'check': 'cpu', 'status': 2,
+                             'ack': 1}},
+                {'_source': {'hostname': 'a', 'check': 'mem', 'status': 0}},
+                {'_source': {'hostname': 'b', 'check': 'disk', 'status': 0,
+                             'downtime': 0}},
+            ],
+            'host': [
+                {'_id': 'a', '_source': {'service_states': {
+                    'cpu': {'status': 2, 'ack': 1},
+                    'old': {'status': 0, 'ack': 0}}}},
+                {'_id': 'b', '_source': {'service_states': {
+                    'disk': {'status': 0, 'ack': 0}}}},
+                {'_id': 'c', '_source': {}},
+            ],
+        })
+        self.backend.elasticclient = client
+        scan, streaming_bulk = helpers.scan, helpers.streaming_bulk
+        helpers.scan = client.scan
+        helpers.streaming_bulk = client.streaming_bulk
+        try:
+            delay = self.backend.rebuild()
+        finally:
+            helpers.scan, helpers.streaming_bulk = scan, streaming_bulk
+
+        # Periodic (service_states_rebuild default)
+        self.assertEqual(delay, 3600)
+        # Missing and dropped services of host a only
+        self.assertEqual(len(client.actions), 1)
+        self.assertEqual(client.actions[0]['_id'], 'a')
+        self.assertEqual(client.actions[0]['doc'], {'service_states': {
+            'mem': {'status': 0, 'ack': 0, 'downtime': 0}, 'old': None}})
+        self.assertTrue(client.actions[0]['_retry_on_conflict'] > 0)
+
+    def test_Expire(self):
+        # Heap mode outdates services and their host states
+        client = ScanClient({})
+        client.mget = lambda **kwargs: {'docs': [
+            {'found': True, '_index': 'status', '_type': 'service',
+             '_id': 'a-cpu', '_version': 1, '_source': {
+                 'hostname': 'a', 'check': 'cpu', 'status': 0,
+                 'output': 'ok', 'freshness': 0}},
+            {'found': True, '_index': 'status', '_type': 'host',
+             '_id': 'b', '_version': 1, '_source': {
+                 'hostname': 'b', 'check': 'Host', 'status': 0,
+                 'output': 'ok', 'freshness': 0}},
+        ]}
+        self.backend.elasticclient = client
+        self.backend._connect = lambda: True
+        streaming_bulk = helpers.streaming_bulk
+        helpers.streaming_bulk = client.streaming_bulk
+        try:
+            self.backend.expire([
+                ('a-cpu', 0, ('service', 'a')), ('b', 0, ('host', 'b'))],
+                2, 'OUTDATED - ')
+        finally:
+            helpers.streaming_bulk = streaming_bulk
+
+        # Outdated documents, then host a services states
+        self.assertEqual(len(client.actions), 3)
+        self.assertEqual(client.actions[2]['_id'], 'a')
+        self.assertEqual(client.actions[2]['doc'], {'service_states': {
+            'cpu': {'status': 2}}})
+        self.assertEqual(self.backend.outdated_states, {})
+
+
+class ListSpool(object):
+    """
+    Spool holding checks in memory
+    """
+    def __init__(self, checks):
+        self.checks = checks
+
+    def empty(self):
+        return not self.checks
+
+    def read(self, count):
+        checks, self.checks = self.checks[:count], self.checks[count:]
+        return checks
+
+
+class ReplayTC(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger('elasticsearch').disabled = True
+        logging.getLogger('tantale.input').disabled = True
+        self.backend = ElasticsearchBackend({
+            'hosts': 'localhost:1', 'sniff_on_start': False,
+            'status_cache_size': 100, 'spool_replay_rate': 100})
+
+    def tearDown(self):
+        logging.getLogger('elasticsearch').disabled = False
+        logging.getLogger('tantale.input').disabled = False
+
+    def check(self, status, timestamp):
+        return Check(
+            check='cpu', hostname='host', status=status,
+            timestamp=timestamp, interval=60, freshness_factor=2)
+
+    def test_Stale(self):
+        # Stored OK at T0, last checked (OK) at T20
+        now = int(time.time())
+        slot = self.backend.slots[0]
+        slot.cache.set(
+            'host-cpu', 0, (now - 100) * 1000, (now + 3600) * 1000,
+            (now - 80) * 1000)
+
+        # Replayed CRIT at T5 neither written nor logged
+        docs = list(self.backend.status_iterator(
+            [[self.check(2, now - 95)]], slot, {}))
+        self.assertEqual(docs, [])
+        self.assertEqual(slot.logs, [])
+
+        # Replayed versions before last check are ignored
+        docs = list(self.backend.status_iterator(
+            [[self.check(2, now - 95), self.check(0, now - 70)]], slot, {}))
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(docs[0]['doc']['status'], 0)
+        self.assertNotIn('timestamp', docs[0]['doc'])
+        self.assertEqual(slot.logs, [])
+
+    def test_Allowance(self):
+        # Allowance not bound to batch size (default 1)
+        checks = [self.check(0, i) for i in range(500)]
+        for check in checks:
+            check.check = 'check_%d' % check.timestamp
+            check.id = 'host-%s' % check.check
+        self.backend.spool = ListSpool(checks)
+        self.backend.replay_ts = time.time() - 10
+        self.backend._replay()
+        self.assertEqual(len(self.backend.checks), 100)
+
+
+class ScriptedTC(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger('elasticsearch').disabled = True
+        logging.getLogger('tantale.input').disabled = True
+        self.backend = ElasticsearchBackend({
+            'hosts': 'localhost:1', 'sniff_on_start': False,
+            'write_mode': 'script'})
+
+    def tearDown(self):
+        logging.getLogger('elasticsearch').disabled = False
+        logging.getLogger('tantale.input').disabled = False
+
+    def test_Requeue(self):
+        statuses = {'host-cpu': 503, 'host-mem': 429, 'host-disk': 400}
+
+        def streaming_bulk(client, actions, **kwargs):
+            for action in actions:
+                yield False, {'update': {
+                    '_id': action['_id'], 'status': statuses[action['_id']]}}
+
+        batch = [
+            [Check(check=name, hostname='host', status=0, timestamp=1,
+                   interval=60, freshness_factor=2)]
+            for name in ('cpu', 'mem', 'disk')]
+        slot = self.backend.slots[0]
+        bulk = helpers.streaming_bulk
+        helpers.streaming_bulk = streaming_bulk
+        try:
+            self.backend._send_to_status_scripted(batch, slot)
+        finally:
+            helpers.streaming_bulk = bulk
+
+        # Failed updates queued back, invalid ones (400) dropped
+        self.assertEqual(
+            sorted(check.id for check in self.backend.requeued),
+            ['host-cpu', 'host-mem'])
+        self.assertEqual(slot.rejected, 1)
@@ -7,19 +7,20 @@ import signal
 import traceback
 import logging
 import time
-import json
 
 import socket
 from threading import Thread, Event
-from six import b as bytes
 
 from tantale.utils import load_class
 from tantale import sources
+from tantale import codec
+from tantale.protocol import msgpack, StringTable, BINARY_MAGIC
+from tantale.metrics.registry import Registry
 
 try:
-    from Queue import Queue
+    from Queue import Queue, Empty
 except:
-    from queue import Queue
+    from queue import Queue, Empty
 
 try:
     from setproctitle import setproctitle, getproctitle
@@ -27,14 +28,23 @@ except ImportError:
     setproctitle = None
 
 
+# Maximum results sent in one binary frame
+SEND_BATCH = 256
+
+
 class Client(object):
     """
     Tantale client
     """
 
-    def __init__(self, config):
+    def __init__(self, config, registry=None):
         self.log = logging.getLogger('tantale.client')
 
+        # Metrics, not allocated (no op) if not given
+        if registry is None:
+            registry = Registry()
+        self.registry = registry
+
         self.config = config['modules']['Client']
         self.config['interval'] = int(self.config['interval'])
 
@@ -46,14 +56,36 @@ class Client(object):
         self.port = int(self.config['server_port'])
         self.sock = None
 
+        # Wire protocol
+        self.binary = self.config['protocol'] == 'msgpack'
+        if self.binary and msgpack is None:
+            self.log.error('msgpack module not found, using json protocol')
+            self.binary = False
+        self.strings = None
+
     def connect(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.setblocking(True)
             self.sock.connect((self.host, self.port))
+
+            if self.binary:
+                # String table is per connection
+                self.strings = StringTable()
+                self.sock.sendall(BINARY_MAGIC)
         except:
             self.sock = None
 
+    def encode(self, results):
+        """
+        Serialize results with configured protocol
+        """
+        if self.binary:
+            return self.strings.frame(results)
+        else:
+            return b''.join(
+                codec.dumpb(result) + b'\n' for result in results)
+
     def sending_thread(self, res_q):
         """
         Send results from queue
@@ -62,23 +94,34 @@ class Client(object):
 
         while True:
             try:
-                result = res_q.get(True)
+                results = [res_q.get(True)]
                 # Not keeping data in memory
                 res_q.task_done()
 
+                # Group results available (binary frame)
+                while self.binary and len(results) < SEND_BATCH:
+                    try:
+                        results.append(res_q.get_nowait())
+                        res_q.task_done()
+                    except Empty:
+                        break
+
                 if not self.sock:
                     self.connect()
 
                 if not self.sock:
+                    self.registry.inc('client_send_errors')
                     self.log.info(
                         'Reconnect to %s:%s failed' % (self.host, self.port))
                     continue
 
-                self.log.debug("Sending: %s" % result)
+                self.log.debug("Sending: %s" % results)
 
                 try:
-                    self.sock.send(bytes(json.dumps(result) + '\n'))
+                    self.sock.sendall(self.encode(results))
+                    self.registry.inc('client_results', len(results))
                 except:
+                    self.registry.inc('client_send_errors')
                     self.log.info("Connection reset")
                     self.log.debug(traceback.format_exc())
                     self.sock = None
@@ -0,0 +1,65 @@
+# coding=utf-8
+"""
+JSON codec used by all modules
+
+Fastest available of 'orjson', 'ujson' (Pypi), then python 'json'.
+    dumps(obj) : text
+    dumpb(obj) : utf-8 bytes
+    loads(bytes or text) : object
+"""
+
+from __future__ import print_function
+
+import json
+from six import binary_type
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 (Pypi 'ordereddict')
+    from ordereddict import OrderedDict
+
+CODECS = OrderedDict()
+
+try:
+    import orjson
+
+    CODECS['orjson'] = (
+        lambda obj: orjson.dumps(obj).decode('utf-8'),
+        orjson.dumps,
+        orjson.loads,
+    )
+except ImportError:
+    pass
+
+try:
+    import ujson
+
+    def _ujson_dumps(obj):
+        return ujson.dumps(
+            obj, ensure_ascii=False, escape_forward_slashes=False)
+
+    CODECS['ujson'] = (
+        _ujson_dumps,
+        lambda obj: _ujson_dumps(obj).encode('utf-8'),
+        ujson.loads,
+    )
+except ImportError:
+    pass
+
+
+def _json_loads(string):
+    if isinstance(string, binary_type):
+        string = string.decode('utf-8')
+    return json.loads(string)
+
+
+CODECS['json'] = (
+    json.dumps,
+    lambda obj: json.dumps(obj).encode('utf-8'),
+    _json_loads,
+)
+
+# Default (fastest) codec
+NAME = list(CODECS.keys())[0]
+dumps, dumpb, loads = CODECS[NAME]
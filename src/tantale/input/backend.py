@@ -6,12 +6,22 @@ import traceback
 
 from tantale.backend import BaseBackend
 
+# Seconds before retrying a failed rebuild
+REBUILD_RETRY = 60
+
 
 class Backend(BaseBackend):
     def __init__(self, config=None):
         super(Backend, self).__init__(config)
 
-        self.ttl_thread = None
+        # Flush delay (seconds), None to use Input ttl
+        self.ttl = None
+        # Checks latency trace (set by Input), None if disabled
+        self.trace = None
+        # Metrics registry (set by Input), None if not shared
+        self.registry = None
+        # Freshness deadlines (set by Input, freshness_mode = heap)
+        self.deadlines = None
         self.checks = []
         self.logs = []
 
@@ -30,6 +40,7 @@ class Backend(BaseBackend):
         try:
             try:
                 self.lock.acquire()
+                self._deadline(check)
                 self.process(check)
             except Exception:
                 self.log.error(traceback.format_exc())
@@ -37,6 +48,38 @@ class Backend(BaseBackend):
             if self.lock.locked():
                 self.lock.release()
 
+    def spooled(self):
+        """
+        Checks waiting in a backend spool (replayed by send)
+        """
+        return False
+
+    def _process_batch(self, checks):
+        """
+        Process a batch of checks, holding the lock once
+        """
+        if not self.enabled:
+            return
+        try:
+            try:
+                self.lock.acquire()
+                for check in checks:
+                    self._deadline(check)
+                    self.process(check)
+            except Exception:
+                self.log.error(traceback.format_exc())
+        finally:
+            if self.lock.locked():
+                self.lock.release()
+
+    def _deadline(self, check):
+        """
+        Track check freshness deadline (freshness_mode = heap)
+        """
+        if self.deadlines is not None:
+            self.deadlines.update(
+                check.id, check.freshness, (check.type, check.hostname))
+
     def process(self, check):
         """
         Process (add check to stack)
@@ -70,3 +113,83 @@ class Backend(BaseBackend):
         Flush
         """
         pass
+
+    def _rebuild(self):
+        """
+        Decorator catching rebuild exceptions (retried after REBUILD_RETRY)
+        """
+        if not self.enabled:
+            return None
+        try:
+            return self.rebuild()
+        except Exception:
+            self.log.error(traceback.format_exc())
+            return REBUILD_RETRY
+
+    def rebuild(self):
+        """
+        Rebuild data derived from stored checks (no lock, backend requests
+        only), run on Input_Backend startup
+        Return seconds before next rebuild, None if no more needed
+        """
+        return None
+
+    def _seed(self, prefix, start_time):
+        """
+        Load freshness deadlines of stored checks (no lock, read only)
+        Return True once done
+        """
+        if not self.enabled:
+            return True
+        try:
+            entries = self.seed(prefix, start_time)
+        except Exception:
+            self.log.error(traceback.format_exc())
+            return False
+        if entries is None:
+            return False
+
+        try:
+            self.lock.acquire()
+            for check_id, deadline, key in entries:
+                self.deadlines.update(check_id, deadline, key)
+        finally:
+            self.lock.release()
+        return True
+
+    def seed(self, prefix, start_time):
+        """
+        Stored checks deadlines : (id, deadline, key) list, None on failure
+        Not outdated ones only (output not starting with prefix), checks
+        last seen before start_time get a grace (one freshness delay)
+        """
+        raise NotImplementedError
+
+    def _expire(self, now, outdated_status, prefix, count):
+        """
+        Decorator outdating checks with passed deadlines, with a lock
+        Return number of expired deadlines (count at most)
+        """
+        if not self.enabled:
+            return 0
+        expired = []
+        try:
+            try:
+                self.lock.acquire()
+                expired = self.deadlines.expired(now, count)
+                if expired:
+                    self.expire(expired, outdated_status, prefix)
+            except Exception:
+                self.log.error(traceback.format_exc())
+        finally:
+            if self.lock.locked():
+                self.lock.release()
+        return len(expired)
+
+    def expire(self, expired, outdated_status, prefix):
+        """
+        Outdate checks (id, deadline, key) list
+            outdated_status : status to be applied on outdated (if OK)
+            prefix : output prefix to apply on outdated
+        """
+        raise NotImplementedError
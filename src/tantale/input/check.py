@@ -1,11 +1,14 @@
 # coding=utf-8
 
 from __future__ import print_function
-from six import integer_types
-import json
+from six import integer_types, binary_type
+from six.moves import zip_longest
 import time
 import traceback
 
+from tantale import codec
+from tantale.protocol import msgpack, BINARY_MAGIC
+
 
 class Check(object):
     # This saves a significant amount of memory per object. This only matters
@@ -15,7 +18,7 @@ class Check(object):
     __slots__ = [
         'type', 'tags', 'id', 'parsing_ts',
         'timestamp', 'hostname', 'check', 'status', 'output',
-        'contacts', 'freshness'
+        'contacts', 'freshness', 'read_ts', 'join_ts'
     ]
 
     # Relevant attributes (to be stored in backend status)
@@ -37,6 +40,9 @@ class Check(object):
         """
         self.status = int(status)
         self.parsing_ts = time.time()
+        # Latency trace (first read by Input, joined to backend batch)
+        self.read_ts = None
+        self.join_ts = None
         self.timestamp = int(timestamp)
         self.contacts = contacts
         self.hostname = hostname
@@ -62,32 +68,86 @@ class Check(object):
             self.tags = {}
 
     @classmethod
-    def parse(cls, string, freshness_factor, log):
+    def parse(cls, string, freshness_factor, log, stats=None):
         """
         Generate Checks object on JSON hash
+        Errors are counted in stats dict if given
         """
         try:
-            checks_hash = json.loads(string)
+            if (
+                isinstance(string, binary_type) and
+                string[:1] == BINARY_MAGIC
+            ):
+                # Binary record (resolved by listener)
+                checks_hash = msgpack.unpackb(string[1:], raw=False)
+            elif isinstance(string, (dict, list)):
+                # Decoded record (resolved by listener)
+                checks_hash = string
+            else:
+                checks_hash = codec.loads(string)
         except:
+            if stats is not None:
+                stats['decode_errors'] += 1
             log.warn('Error loading client JSON')
             log.debug(traceback.format_exc())
             log.debug(string)
             return
 
-        try:
-            yield Check(
-                freshness_factor=freshness_factor, **checks_hash)
-        except:
-            log.info('CHECK: Error on %s' % checks_hash)
-            log.debug(traceback.format_exc())
+        # Multiple checks (list and/or envelopes)
+        if isinstance(checks_hash, list):
+            hashes = checks_hash
+        else:
+            hashes = [checks_hash]
+
+        for checks_hash in hashes:
+            try:
+                check_hashes = cls.expand(checks_hash)
+            except:
+                if stats is not None:
+                    stats['check_errors'] += 1
+                log.info('CHECK: Invalid envelope %s' % checks_hash)
+                log.debug(traceback.format_exc())
+                continue
+
+            for check_hash in check_hashes:
+                try:
+                    yield Check(
+                        freshness_factor=freshness_factor, **check_hash)
+                except:
+                    if stats is not None:
+                        stats['check_errors'] += 1
+                    log.info('CHECK: Error on %s' % check_hash)
+                    log.debug(traceback.format_exc())
+
+    @staticmethod
+    def expand(checks_hash):
+        """
+        Expand an envelope to checks hashes
+            {"hostname": ..., "checks": [{"check": ...}, ...]}
+        Envelope keys are shared by checks (overwritten by check ones)
+        Raise ValueError if checks is not a list of hashes
+        """
+        if not isinstance(checks_hash, dict) or 'checks' not in checks_hash:
+            return [checks_hash]
+
+        shared = dict(checks_hash)
+        deltas = shared.pop('checks')
+        if not isinstance(deltas, list) or \
+           not all(isinstance(delta, dict) for delta in deltas):
+            raise ValueError('Envelope checks must be a list of hashes')
+
+        hashes = []
+        for delta in deltas:
+            check_hash = dict(shared)
+            check_hash.update(delta)
+            hashes.append(check_hash)
+        return hashes
 
     def __getstate__(self):
-        return dict(
-            (slot, getattr(self, slot))
-            for slot in self.__slots__
-            if hasattr(self, slot)
-        )
+        # Values ordered as slots (compact pickle between processes)
+        return tuple(getattr(self, slot, None) for slot in self.__slots__)
 
     def __setstate__(self, state):
-        for slot, value in state.items():
+        # Missing values (older pickles, spool) are None
+        for slot, value in zip_longest(self.__slots__, state):
             setattr(self, slot, value)
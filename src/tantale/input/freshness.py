@@ -0,0 +1,84 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import heapq
+
+# Stale heap entries (replaced deadlines) allowed before compaction
+COMPACT_RATIO = 2
+COMPACT_MIN = 65536
+
+
+class FreshnessHeap(object):
+    """
+    Freshness deadlines (seconds) by check id, min-heap
+    A later deadline replaces previous one (stale entries skipped when
+    popped). Key is kept with the deadline (backend document locator).
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def update(self, check_id, deadline, key=None):
+        """
+        Set check deadline, earlier ones are ignored (older checks)
+        """
+        current = self.deadlines.get(check_id)
+        if current is not None and current[0] >= deadline:
+            return
+
+        self.deadlines[check_id] = (deadline, key)
+        heapq.heappush(self.heap, (deadline, check_id))
+
+        if len(self.heap) > COMPACT_MIN and \
+           len(self.heap) > COMPACT_RATIO * len(self.deadlines):
+            self._compact()
+
+    def expired(self, now, count):
+        """
+        Pop up to count checks with deadline passed
+        Return (check id, deadline, key) list
+        """
+        expired = []
+        while self.heap and len(expired) < count:
+            deadline, check_id = self.heap[0]
+            if deadline > now:
+                break
+            heapq.heappop(self.heap)
+
+            current = self.deadlines.get(check_id)
+            if current is None or current[0] != deadline:
+                # Replaced
+                continue
+            del self.deadlines[check_id]
+            expired.append((check_id, deadline, current[1]))
+        return expired
+
+    def _compact(self):
+        """
+        Rebuild heap without stale entries
+        """
+        self.heap = [
+            (deadline, check_id)
+            for check_id, (deadline, key) in self.deadlines.items()]
+        heapq.heapify(self.heap)
+
+
+def partitions(partition, count, live):
+    """
+    Freshness partitions handled by an Input : its own one, and its share
+    of orphans (partitions without live lease), spread over live Inputs
+    """
+    live = sorted(set(live) | set([partition]))
+    orphans = [number for number in range(count) if number not in live]
+
+    handled = [partition]
+    rank = live.index(partition)
+    for i, orphan in enumerate(orphans):
+        if i % len(live) == rank:
+            handled.append(orphan)
+    return handled
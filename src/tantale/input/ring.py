@@ -0,0 +1,178 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import mmap
+import time
+import struct
+from multiprocessing import Lock, Condition
+from multiprocessing.sharedctypes import RawArray
+
+try:
+    from Queue import Full, Empty
+except:
+    from queue import Full, Empty
+
+# Record header : payload length
+HEADER = struct.Struct('!I')
+
+# Shared state offsets
+HEAD, TAIL, USED, RECORDS, DROPS = range(5)
+
+
+class RingQueue(object):
+    """
+    Shared memory ring buffer of length-prefixed byte records
+    Replace multiprocessing queue between Input processes (no pickling,
+    no feeder thread). Must be created before forking producers and
+    consumers.
+
+    Items are records batches (list of bytes), stored as one record of
+    length-prefixed records. None is stored as an empty record.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+        # Anonymous mapping is shared with forked processes
+        self.buf = mmap.mmap(-1, size)
+        self.state = RawArray('L', 5)
+
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+
+    def put(self, item, block=True, timeout=None):
+        if item is None:
+            data = b''
+        else:
+            data = b''.join(
+                HEADER.pack(len(record)) + record for record in item)
+        need = HEADER.size + len(data)
+
+        if need > self.size:
+            raise Full
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self.lock:
+            while self.size - self.state[USED] < need:
+                if not block:
+                    raise Full
+                if deadline is None:
+                    self.not_full.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Full
+                    self.not_full.wait(remaining)
+
+            tail = self.state[TAIL]
+            tail = self._write(tail, HEADER.pack(len(data)))
+            tail = self._write(tail, data)
+            self.state[TAIL] = tail
+            self.state[USED] += need
+            self.state[RECORDS] += 1
+
+            self.not_empty.notify()
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self.lock:
+            while self.state[RECORDS] == 0:
+                if not block:
+                    raise Empty
+                if deadline is None:
+                    self.not_empty.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+
+            head = self.state[HEAD]
+            head, header = self._read(head, HEADER.size)
+            length = HEADER.unpack(header)[0]
+            head, data = self._read(head, length)
+            self.state[HEAD] = head
+            self.state[USED] -= HEADER.size + length
+            self.state[RECORDS] -= 1
+
+            self.not_full.notify()
+
+        if length == 0:
+            return None
+
+        records = []
+        offset = 0
+        while offset < length:
+            size = HEADER.unpack_from(data, offset)[0]
+            offset += HEADER.size
+            records.append(data[offset:offset + size])
+            offset += size
+        return records
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        """
+        Nothing to acknowledge (queue interface)
+        """
+        pass
+
+    def qsize(self):
+        return self.state[RECORDS]
+
+    def empty(self):
+        return self.state[RECORDS] == 0
+
+    def fill(self):
+        """
+        Used part of the ring (0 to 1)
+        """
+        return float(self.state[USED]) / self.size
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'used': self.state[USED],
+            'records': self.state[RECORDS],
+            'drops': self.state[DROPS],
+        }
+
+    def drop(self):
+        """
+        Account an item discarded by its producer (Full not retried)
+        """
+        with self.lock:
+            self.state[DROPS] += 1
+
+    def _write(self, offset, data):
+        """
+        Write data at offset (wrapping), return next offset
+        """
+        length = len(data)
+        first = min(length, self.size - offset)
+        self.buf[offset:offset + first] = data[:first]
+        if first < length:
+            self.buf[0:length - first] = data[first:]
+        return (offset + length) % self.size
+
+    def _read(self, offset, length):
+        """
+        Read length bytes at offset (wrapping), return next offset and data
+        """
+        first = min(length, self.size - offset)
+        data = self.buf[offset:offset + first]
+        if first < length:
+            data += self.buf[0:length - first]
+        return (offset + length) % self.size, data
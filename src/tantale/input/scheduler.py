@@ -0,0 +1,143 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+import heapq
+import itertools
+import threading
+import traceback
+
+# Seconds between sends of a backend only having spooled checks (replay)
+REPLAY_INTERVAL = 1
+
+
+class FlushScheduler(object):
+    """
+    Send backends pending checks once the oldest one waited ttl seconds
+    One thread, deadlines in a heap (one pending deadline per backend)
+
+    Backend ttl attribute (if set) overrides default ttl
+    Backend with spooled checks only is sent every REPLAY_INTERVAL
+    """
+
+    def __init__(self, ttl, lock, log):
+        self.ttl = ttl
+        self.lock = lock
+        self.log = log
+
+        self.heap = []
+        self.deadlines = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def schedule(self, backend, deadline=None):
+        """
+        Schedule backend send at deadline (default on oldest check ttl)
+        Earlier deadline already scheduled is kept
+        """
+        if deadline is None:
+            ttl = backend.ttl or self.ttl
+            if not ttl:
+                return
+            if len(backend.checks) > 0:
+                deadline = backend.checks[0].parsing_ts + ttl
+            elif backend.spooled():
+                deadline = time.time() + REPLAY_INTERVAL
+            else:
+                return
+
+        key = id(backend)
+        with self.cond:
+            if key in self.deadlines and self.deadlines[key] <= deadline:
+                return
+            self.deadlines[key] = deadline
+            heapq.heappush(
+                self.heap, (deadline, next(self.counter), key, backend))
+            self.cond.notify()
+
+    def flush(self, backend):
+        """
+        Request a send of all pending checks now
+        """
+        self.schedule(backend, 0)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    if self.heap:
+                        timeout = self.heap[0][0] - time.time()
+                        if timeout <= 0:
+                            break
+                        self.cond.wait(timeout)
+                    else:
+                        self.cond.wait()
+                if not self.running:
+                    return
+
+                deadline, count, key, backend = heapq.heappop(self.heap)
+                if self.deadlines.get(key) != deadline:
+                    # Replaced by an earlier one
+                    continue
+                del self.deadlines[key]
+
+            try:
+                self._send(backend, deadline == 0)
+            except:
+                self.log.error('Flush scheduler: send failed')
+                self.log.debug(traceback.format_exc())
+
+    def _send(self, backend, force):
+        """
+        Send if oldest check waited ttl (all pending ones if forced),
+        then schedule next one
+        Spooled checks only are sent (replayed) as soon as due
+        """
+        ttl = backend.ttl or self.ttl or 0
+        with self.lock:
+            now = time.time()
+            if len(backend.checks) > 0:
+                deadline = backend.checks[0].parsing_ts + ttl
+            elif backend.spooled():
+                deadline = now
+            else:
+                return
+
+            if force or deadline <= now:
+                if force:
+                    self._drain(backend)
+                else:
+                    backend.send()
+                if len(backend.checks) > 0:
+                    # Retry backlog after ttl
+                    deadline = max(
+                        backend.checks[0].parsing_ts + ttl, now + ttl)
+                elif backend.spooled():
+                    deadline = now + REPLAY_INTERVAL
+                else:
+                    return
+
+        self.schedule(backend, deadline)
+
+    def _drain(self, backend):
+        """
+        Send until no checks are pending (or a send makes no progress)
+        """
+        pending = None
+        while len(backend.checks) > 0 and len(backend.checks) != pending:
+            pending = len(backend.checks)
+            backend.send()
+        if pending is None:
+            # Spooled checks only
+            backend.send()
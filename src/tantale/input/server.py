@@ -4,6 +4,7 @@ from __future__ import print_function
 
 import os
 import sys
+import errno
 import signal
 import traceback
 import logging
@@ -11,11 +12,18 @@ import time
 
 import socket
 import select
-from six import b as bytes
+from six import b as bytes, binary_type
 from threading import Thread, Lock
+from multiprocessing import Value
 
 from tantale.utils import load_backend
 from tantale.input.check import Check
+from tantale.input.freshness import FreshnessHeap, partitions
+from tantale.input.scheduler import FlushScheduler
+from tantale.input.trace import Trace
+from tantale.metrics.registry import Registry
+from tantale.protocol import msgpack, resolve
+from tantale.protocol import BINARY_MAGIC, FRAME_HEADER, MAX_FRAME, MAX_STRINGS
 
 try:
     from Queue import Full
@@ -27,12 +35,257 @@ try:
 except ImportError:
     setproctitle = None
 
+try:
+    memoryview
+except NameError:
+    # Python 2.6, buffers slices are copied
+    memoryview = None
+
+
+# Linux value (missing in python < 3.4 socket module)
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+# Linux value (missing in python < 3.3 select module)
+EPOLLRDHUP = getattr(select, 'EPOLLRDHUP', 0x2000)
+
+# Bytes read per recv call
+RECV_SIZE = 65536
+# Maximum connections accepted per listener event
+ACCEPT_BATCH = 128
+# Maximum datagrams read per udp event
+DATAGRAM_BATCH = 256
+# Seconds between counters reports
+REPORT_INTERVAL = 60
+# Seconds between queue fill checks while paused (backpressure)
+PAUSE_INTERVAL = 0.05
+# Seconds waiting queue on exit
+EXIT_TIMEOUT = 5
+# Seconds between freshness deadlines checks (heap mode)
+FRESHNESS_TICK = 1
+# Seconds between backends rebuilds checks
+REBUILD_TICK = 1
+# Maximum checks outdated by backend request (heap mode)
+EXPIRE_BATCH = 1000
+# Outdated checks status and output prefix
+OUTDATED_STATUS = 2
+OUTDATED_PREFIX = 'OUTDATED - '
+# Freshness partition lease duration (in freshness intervals)
+FRESHNESS_LEASE = 3
+
+
+def tobytes(data):
+    """
+    Bytes of a buffer slice (memoryview or bytearray)
+    """
+    if memoryview is not None and isinstance(data, memoryview):
+        return data.tobytes()
+    return binary_type(data)
+
+
+class Connection(object):
+    """
+    Client connection with its pending (not complete) bytes
+    Text (JSON lines) or binary (msgpack frames) detected on first byte
+    Binary frames are forwarded as resolved objects, or repacked as bytes
+    records when queue transport only carries bytes (ring)
+    Count lines dropped and pauses (backpressure) of this client
+    """
+    __slots__ = [
+        'sock', 'addr', 'stats', 'buffer', 'binary', 'strings', 'repack',
+        'sizes', 'dropped', 'paused',
+    ]
+
+    def __init__(self, sock, addr, stats, repack=False):
+        self.sock = sock
+        self.addr = addr
+        self.stats = stats
+        self.buffer = bytearray()
+        self.binary = None
+        self.strings = []
+        self.repack = repack
+        self.sizes = []
+
+        self.dropped = 0
+        self.paused = 0
+
+    def feed(self, data):
+        """
+        Append received data to buffer
+        Return complete records (lines without ending newline)
+        """
+        buf = self.buffer
+        buf += data
+
+        if self.binary is None:
+            self.binary = buf[:1] == BINARY_MAGIC
+            if self.binary:
+                if msgpack is None:
+                    raise ValueError('Binary client but no msgpack module')
+                del buf[:1]
+
+        if self.binary:
+            return self._frames()
+
+        lines = []
+        start = 0
+        idx = buf.find(b'\n')
+        if idx == -1:
+            return lines
+
+        view = memoryview(buf) if memoryview else buf
+        while idx != -1:
+            if idx > start:
+                lines.append(tobytes(view[start:idx]))
+            start = idx + 1
+            idx = buf.find(b'\n', start)
+        # Release export before resizing buffer
+        del view
+
+        del buf[:start]
+        return lines
+
+    def _frames(self):
+        """
+        Decode complete frames, resolving connection string table
+        Return one record per frame: resolved checks, or magic byte +
+        msgpack checks if repack. Frames sizes are kept in sizes
+        """
+        buf = self.buffer
+        records = []
+        self.sizes = []
+        start = 0
+
+        while len(buf) - start >= FRAME_HEADER.size:
+            length = FRAME_HEADER.unpack_from(buf, start)[0]
+            if length > MAX_FRAME:
+                raise ValueError('Frame too large (%d bytes)' % length)
+
+            end = start + FRAME_HEADER.size + length
+            if len(buf) < end:
+                break
+
+            strings, checks = msgpack.unpackb(
+                buf[start + FRAME_HEADER.size:end], raw=False)
+            self.strings.extend(strings)
+            if len(self.strings) > MAX_STRINGS:
+                raise ValueError('String table too large')
+
+            checks = resolve(self.strings, checks)
+            if self.repack:
+                checks = BINARY_MAGIC + msgpack.packb(
+                    checks, use_bin_type=True)
+            records.append(checks)
+            self.sizes.append(length)
+            start = end
+
+        del buf[:start]
+        return records
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class Batcher(object):
+    """
+    Group lines in batches, queued as one item
+    Batch is queued when full (lines or bytes) or delay expired
+    When queue is full, batch is dropped or kept (backpressure)
+    Traced batches end with a trailer record (first read, queued times)
+    """
+    __slots__ = [
+        'log', 'queue', 'max_lines', 'max_bytes', 'delay', 'keep', 'trace',
+        'registry', 'lines', 'origins', 'size', 'deadline', 'read_ts',
+    ]
+
+    def __init__(
+        self, queue, max_lines, max_bytes, delay, keep, log, trace=False,
+        registry=None
+    ):
+        self.log = log
+        self.queue = queue
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.delay = delay
+        self.keep = keep
+        self.trace = trace
+        self.registry = registry
+
+        self.lines = []
+        self.origins = []
+        self.size = 0
+        self.deadline = None
+        self.read_ts = None
+
+    def add(self, line, origin, size=None):
+        """
+        Add a line, origin is its connection (for drops accounting)
+        Size defaults to line length (given for decoded records)
+        """
+        if not self.lines:
+            self.read_ts = time.time()
+            self.deadline = self.read_ts + self.delay
+
+        self.lines.append(line)
+        self.origins.append(origin)
+        self.size += len(line) if size is None else size
+
+        if len(self.lines) >= self.max_lines or self.size >= self.max_bytes:
+            self.flush()
+
+    def timeout(self):
+        """
+        Seconds left before batch expiry (-1 if empty)
+        """
+        if not self.lines:
+            return -1
+        return max(0, self.deadline - time.time())
+
+    def flush(self, timeout=None):
+        """
+        Queue batch (waiting timeout seconds if given)
+        """
+        if not self.lines:
+            return
+
+        if self.trace:
+            self.lines.append(Trace.trailer(self.read_ts, time.time()))
+
+        try:
+            self.queue.put(
+                self.lines, block=timeout is not None, timeout=timeout)
+        except Full:
+            if self.trace:
+                self.lines.pop()
+
+            if self.keep and timeout is None:
+                # Retry later
+                self.deadline = time.time() + self.delay
+                return
+
+            self.log.error('Queue full, dropping %d lines' % len(self.lines))
+            if hasattr(self.queue, 'drop'):
+                # Ring queue drops accounting
+                self.queue.drop()
+            for origin in self.origins:
+                origin.dropped += 1
+                origin.stats['dropped'] += 1
+            if self.registry is not None:
+                self.registry.inc('input_dropped', len(self.lines))
+
+        self.lines = []
+        self.origins = []
+        self.size = 0
+
 
 class InputServer(object):
     """
     Listening thread for Input function
+    Checks stages latency is recorded in trace (if given)
+    Processes counters are kept in metrics registry (if given)
     """
-    def __init__(self, config):
+    def __init__(self, config, trace=None, registry=None):
         # Initialize Logging
         self.log = logging.getLogger('tantale.input')
 
@@ -41,111 +294,414 @@ class InputServer(object):
 
         # Initialize Members
         self.config = config
+        self.trace = trace
+        if registry is None:
+            # Not allocated (no op)
+            registry = Registry()
+        self.registry = registry
 
         self.port = int(self.config['modules']['Input']['port'])
+        self.unix_socket = self.config['modules']['Input']['unix_socket']
+        self.udp_port = int(self.config['modules']['Input']['udp_port'])
+        self.max_connections = int(
+            self.config['modules']['Input']['max_connections'])
+        self.input_workers = max(1, int(
+            self.config['modules']['Input']['input_workers']))
+        self.decode_workers = max(0, int(
+            self.config['modules']['Input']['decode_workers']))
+        self.batch_lines = int(
+            self.config['modules']['Input']['queue_batch_lines'])
+        self.batch_bytes = int(
+            self.config['modules']['Input']['queue_batch_bytes'])
+        self.batch_delay = float(
+            self.config['modules']['Input']['queue_batch_delay']) / 1000
+        self.queue_size = int(self.config['modules']['Input']['queue_size'])
+        self.queue_transport = \
+            self.config['modules']['Input']['queue_transport']
+        self.backpressure = \
+            self.config['modules']['Input']['queue_full'] == 'backpressure'
+        self.high_watermark = float(
+            self.config['modules']['Input']['queue_high_watermark']) / 100
+        self.low_watermark = float(
+            self.config['modules']['Input']['queue_low_watermark']) / 100
         self.ttl = int(self.config['modules']['Input']['ttl'])
         self.freshness_factor = int(
             self.config['modules']['Input']['freshness_factor'])
         self.freshness_interval = int(
             self.config['modules']['Input']['freshness_interval'])
+        self.freshness_mode = \
+            self.config['modules']['Input']['freshness_mode']
 
-    def run(self, check_queue, init_done):
+        # Freshness partition (index, count) of this Input, None for all
+        self.freshness_partition = None
+        partition = self.config['modules']['Input']['freshness_partition']
+        if partition:
+            try:
+                index, count = [int(value) for value in partition.split('/')]
+                if not 0 <= index < count:
+                    raise ValueError(partition)
+                self.freshness_partition = (index, count)
+            except:
+                self.log.error(
+                    'Invalid freshness_partition %s (i/N expected), '
+                    'ignored' % partition)
+
+        # Running producers (last one to exit terminates consumers)
+        self.listeners_alive = Value('i', self.input_workers)
+        self.decoders_alive = Value('i', self.decode_workers)
+
+    def run(self, check_queue, init_done, worker=0):
         if setproctitle:
-            setproctitle('%s - Input' % getproctitle())
+            if self.input_workers > 1:
+                setproctitle('%s - Input_%d' % (getproctitle(), worker))
+            else:
+                setproctitle('%s - Input' % getproctitle())
 
-        # Open listener
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Open listeners
+        #   streams : {fd: (socket, endpoint)}
+        streams = {}
+        udp = None
         try:
-            port = self.port
-            s.bind(('', port))
-        except socket.error as msg:
+            s = self._listen(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(('', self.port))
+            s.listen(1024)
+            streams[s.fileno()] = (s, 'tcp')
+            self.log.info("Listening on %s" % self.port)
+
+            # Unix socket cannot be shared, first worker only
+            if self.unix_socket and worker == 0:
+                if os.path.exists(self.unix_socket):
+                    os.unlink(self.unix_socket)
+                u = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                u.bind(self.unix_socket)
+                u.listen(1024)
+                streams[u.fileno()] = (u, 'unix')
+                self.log.info("Listening on %s" % self.unix_socket)
+
+            if self.udp_port:
+                udp = self._listen(socket.AF_INET, socket.SOCK_DGRAM)
+                udp.bind(('', self.udp_port))
+                self.log.info("Listening on udp %s" % self.udp_port)
+        except (AttributeError, socket.error):
             self.log.critical('Socket bind failed.')
             self.log.debug(traceback.format_exc())
             return
 
-        s.listen(1024)
-        self.log.info("Listening on %s" % port)
+        for sock, endpoint in streams.values():
+            sock.setblocking(0)
+        if udp:
+            udp.setblocking(0)
         init_done.set()
 
-        # Create a poller object
-        connections = select.poll()
-        poll_map = select.POLLIN | select.POLLPRI | select.POLLHUP
-        fd_to_socket = {s.fileno(): s}
-        connections.register(s, poll_map)
+        # Signals (wake up poller with a pipe)
+        pipe = os.pipe()
 
         def sig_handler(signum, frame):
             self.log.debug("%s received" % signum)
             self.running = False
-            s.close()
+            os.write(pipe[1], bytes('END'))
         signal.signal(signal.SIGTERM, sig_handler)
 
-        # Logic
-        queue_state = True
-        stack = {}
+        # Create a poller object
+        #   listeners are level triggered (accept by batches)
+        #   clients are edge triggered (drained on each event)
+        poller = select.epoll()
+        for fd in streams:
+            poller.register(fd, select.EPOLLIN)
+        if udp:
+            poller.register(udp.fileno(), select.EPOLLIN)
+        poller.register(pipe[0], select.EPOLLIN)
+        client_map = select.EPOLLIN | EPOLLRDHUP | select.EPOLLET
+        hup_map = select.EPOLLHUP | select.EPOLLERR | EPOLLRDHUP
+        accepting = True
+        clients = {}
+
+        # Endpoints counters
+        endpoints = [endpoint for sock, endpoint in streams.values()]
+        if udp:
+            endpoints.append('udp')
+        stats = {}
+        for endpoint in endpoints:
+            stats[endpoint] = {
+                'records': 0, 'dropped': 0, 'errors': 0, 'paused': 0}
+            if endpoint == 'udp':
+                stats[endpoint]['datagrams'] = 0
+            else:
+                stats[endpoint]['connections'] = 0
+        report_ts = time.time()
+
+        # Datagrams origin (for drops accounting)
+        if udp:
+            udp_origin = Connection(udp, None, stats['udp'])
 
+        # Backpressure - not reading clients while paused
+        paused = False
+
+        # Reusable receive buffer
+        chunk = bytearray(RECV_SIZE)
+        if memoryview:
+            chunk = memoryview(chunk)
+
+        # Lines grouped before queuing
+        batcher = Batcher(
+            check_queue, self.batch_lines, self.batch_bytes,
+            self.batch_delay, self.backpressure, self.log,
+            self.trace is not None, self.registry)
+
+        # Logic
         try:
             while self.running:
-                r = None
+                timeout = REPORT_INTERVAL - (time.time() - report_ts)
+                if batcher.lines:
+                    timeout = min(timeout, batcher.timeout())
+                if paused:
+                    timeout = min(timeout, PAUSE_INTERVAL)
+
                 try:
-                    poll_array = connections.poll()
-                except:
+                    events = poller.poll(max(0, timeout))
+                except (IOError, OSError):
                     # Handle "Interrupted system call"
                     break
 
-                for fd, event in poll_array:
-                    sock = fd_to_socket[fd]
-
-                    if sock is s:
-                        if event & select.POLLNVAL:
-                            # Stop server
-                            break
-                        else:
-                            # New clients
-                            sockfd, addr = s.accept()
-                            sockfd.setblocking(0)
-                            fd_to_socket[sockfd.fileno()] = sockfd
-                            connections.register(sockfd, poll_map)
-
-                    elif event & (select.POLLIN | select.POLLPRI):
-                        data = sock.recv(4096).decode('utf-8')
-                        key = sock.getpeername()
-
-                        if data == '':
-                            # Disconnect
-                            del stack[key]
-                            connections.unregister(fd)
-                            continue
-
-                        if (
-                            data[0] != '{' and
-                            key in stack and stack[key] != ""
-                        ):
-                            data = stack[key] + data.decode('utf-8')
-
-                        while True:
-                            idx = data.find('\n')
-                            if idx == -1:
-                                stack[key] = data
-                                break
-                            line = data[:idx]
-                            data = data[idx + 1:]
-
-                            try:
-                                check_queue.put(line, block=False)
-                            except Full:
-                                self.log.error('Queue full, dropping')
-
-                    elif event & select.POLLHUP:
-                        # Hung up clients
-                        sock.close()
-                        connections.unregister(fd)
+                for fd, event in events:
+                    if fd in streams:
+                        # New clients
+                        sock, endpoint = streams[fd]
+                        self._accept(
+                            sock, poller, 0 if paused else client_map,
+                            clients, stats[endpoint])
+                        if (accepting and
+                                len(clients) >= self.max_connections):
+                            self.log.warn(
+                                'Max connections reached (%d), '
+                                'pausing accept' % self.max_connections)
+                            for listener in streams:
+                                poller.unregister(listener)
+                            accepting = False
+
+                    elif udp and fd == udp.fileno():
+                        if not paused:
+                            self._read_datagrams(
+                                udp_origin, chunk, batcher)
+
+                    elif fd in clients:
+                        conn = clients[fd]
+                        alive = True
+
+                        if event & select.EPOLLIN:
+                            alive = self._read(conn, chunk, batcher)
+
+                        if not alive or event & hup_map:
+                            # Disconnect / hung up clients
+                            poller.unregister(fd)
+                            del clients[fd]
+                            conn.close()
+                            self.registry.inc('input_connections', -1)
+                            self._report_clients([conn])
+
+                if not accepting and len(clients) < self.max_connections:
+                    for listener in streams:
+                        poller.register(listener, select.EPOLLIN)
+                    accepting = True
+
+                if batcher.timeout() == 0:
+                    batcher.flush()
+
+                # Stop reading clients (TCP flow control push back)
+                # above high watermark, until low watermark
+                if self.backpressure:
+                    fill = self._queue_fill(check_queue)
+                    if not paused and fill >= self.high_watermark:
+                        self.log.warn(
+                            'Queue %d%% full, pausing clients' % (
+                                fill * 100))
+                        paused = True
+                        self._pause(poller, 0, clients, udp, stats)
+                    elif paused and fill <= self.low_watermark:
+                        self.log.info(
+                            'Queue %d%% full, resuming clients' % (
+                                fill * 100))
+                        paused = False
+                        self._pause(poller, client_map, clients, udp, stats)
+
+                if time.time() - report_ts >= REPORT_INTERVAL:
+                    self._report_endpoints(stats, len(clients))
+                    self._report_clients(clients.values())
+                    report_ts = time.time()
         except:
             self.log.critical("Fatal Input error")
             self.log.debug(traceback.format_exc())
         finally:
             self.log.info("Exit")
-            check_queue.put(None, block=False)
+            batcher.flush(EXIT_TIMEOUT)
+            self._report_endpoints(stats, len(clients))
+            if self.unix_socket and worker == 0:
+                try:
+                    os.unlink(self.unix_socket)
+                except OSError:
+                    pass
+            self._terminate(
+                self.listeners_alive, check_queue,
+                max(1, self.decode_workers))
+
+    def _listen(self, family, kind):
+        """
+        Create an Input socket
+        Shared with other workers when input_workers > 1
+        """
+        sock = socket.socket(family, kind)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.input_workers > 1:
+            # Kernel balance connections / datagrams over workers sockets
+            sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        return sock
+
+    def _queue_fill(self, queue):
+        """
+        Used part of queue (0 to 1)
+        """
+        if hasattr(queue, 'fill'):
+            return queue.fill()
+        return float(queue.qsize()) / self.queue_size
+
+    def _pause(self, poller, client_map, clients, udp, stats):
+        """
+        Change clients polling (0 to pause, stay notified of hang ups)
+        """
+        for fd, conn in clients.items():
+            poller.modify(fd, client_map)
+            if client_map == 0:
+                conn.paused += 1
+                conn.stats['paused'] += 1
+        if client_map == 0:
+            self.registry.inc('input_paused', len(clients))
+
+        if udp:
+            poller.modify(udp.fileno(), client_map and select.EPOLLIN)
+            if client_map == 0:
+                stats['udp']['paused'] += 1
+
+    def _report_endpoints(self, stats, connected):
+        """
+        Log endpoints counters (reset after report)
+        """
+        for endpoint in sorted(stats):
+            counters = stats[endpoint]
+            self.log.info('Input %s: %s' % (endpoint, ', '.join(
+                '%s %d' % (key, counters[key]) for key in sorted(counters))))
+            for key in counters:
+                counters[key] = 0
+
+        self.log.debug('Input: %d clients connected' % connected)
+
+    def _report_clients(self, conns):
+        """
+        Log clients dropped lines and pauses (reset after report)
+        """
+        for conn in conns:
+            if conn.dropped or conn.paused:
+                self.log.info('Client %s: %d dropped, %d paused' % (
+                    conn.addr, conn.dropped, conn.paused))
+                conn.dropped = 0
+                conn.paused = 0
+
+    def _terminate(self, alive, queue, consumers):
+        """
+        Decrement running producers
+        Last one send a terminate item to each queue consumer
+        """
+        with alive.get_lock():
+            alive.value -= 1
+            last = alive.value == 0
+
+        if last:
+            for i in range(consumers):
+                queue.put(None)
+
+    def _accept(self, s, poller, client_map, clients, stats):
+        """
+        Accept pending connections (ACCEPT_BATCH at most)
+        """
+        for i in range(ACCEPT_BATCH):
+            if len(clients) >= self.max_connections:
+                return
+            try:
+                sockfd, addr = s.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sockfd.setblocking(0)
+            clients[sockfd.fileno()] = Connection(
+                sockfd, addr, stats, repack=self.queue_transport == 'ring')
+            poller.register(sockfd.fileno(), client_map)
+            stats['connections'] += 1
+            self.registry.inc('input_connections')
+
+    def _read(self, conn, chunk, batcher):
+        """
+        Drain a client socket, batch complete lines
+        Return False when client disconnected
+        """
+        while True:
+            try:
+                size = conn.sock.recv_into(chunk)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                elif e.args[0] == errno.EINTR:
+                    continue
+                conn.stats['errors'] += 1
+                self.registry.inc('input_errors')
+                return False
+
+            if size == 0:
+                return False
+
+            try:
+                records = conn.feed(chunk[:size])
+            except Exception:
+                conn.stats['errors'] += 1
+                self.registry.inc('input_errors')
+                self.log.warn('Invalid client data, disconnecting')
+                self.log.debug(traceback.format_exc())
+                return False
+
+            conn.stats['records'] += len(records)
+            self.registry.inc('input_records', len(records))
+            if conn.binary:
+                for record, length in zip(records, conn.sizes):
+                    batcher.add(record, conn, length)
+            else:
+                for record in records:
+                    batcher.add(record, conn)
+
+    def _read_datagrams(self, origin, chunk, batcher):
+        """
+        Read pending datagrams (DATAGRAM_BATCH at most)
+        Each datagram holds complete lines
+        """
+        stats = origin.stats
+        for i in range(DATAGRAM_BATCH):
+            try:
+                size = origin.sock.recv_into(chunk)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                elif e.args[0] == errno.EINTR:
+                    continue
+                stats['errors'] += 1
+                self.registry.inc('input_errors')
+                return
+
+            stats['datagrams'] += 1
+            records = 0
+            for line in tobytes(chunk[:size]).split(b'\n'):
+                if line:
+                    records += 1
+                    batcher.add(line, origin)
+            stats['records'] += records
+            self.registry.inc('input_records', records)
 
     def input_backend(self, check_queue):
         if setproctitle:
@@ -161,6 +717,8 @@ class InputServer(object):
                 cls = load_backend('input', backend)
                 backends.append(
                     cls(self.config['backends'].get(backend, None)))
+                backends[-1].trace = self.trace
+                backends[-1].registry = self.registry
             except:
                 self.log.error('Error loading backend %s' % backend)
                 self.log.debug(traceback.format_exc())
@@ -170,52 +728,269 @@ class InputServer(object):
 
         send_lock = Lock()
 
-        def ttl_thread(ttl, backend):
-            time.sleep(ttl)
-            # Force send it ttl reached
-            if (len(backend.checks) > 0 and
-               (time.time() - backend.checks[0].parsing_ts) >= ttl):
-                send_lock.acquire()
-                backend.send()
-                send_lock.release()
+        # Send pending checks on ttl
+        scheduler = FlushScheduler(self.ttl, send_lock, self.log)
+
+        # Replay checks spooled before a restart
+        for backend in backends:
+            scheduler.schedule(backend)
+
+        # Rebuild data derived from stored checks
+        t = Thread(target=self.rebuilds, args=(backends,))
+        t.daemon = True
+        t.start()
+
+        # Outdate checks on their freshness deadline
+        if self.freshness_mode == 'heap' and self.freshness_interval > 0:
+            for backend in backends:
+                backend.deadlines = FreshnessHeap()
+            t = Thread(
+                target=self.freshness_deadlines, args=(backends, send_lock))
+            t.daemon = True
+            t.start()
+
+        # Explicit flush request
+        def flush_handler(signum, frame):
+            for backend in backends:
+                scheduler.flush(backend)
+        signal.signal(signal.SIGUSR1, flush_handler)
+
+        # Ring queue state reporting (when not read by decoders)
+        report = hasattr(check_queue, 'stats') and not self.decode_workers
+        ring_state = {'drops': 0, 'ts': time.time()}
+
+        # Latency trace reporting
+        trace_state = {'snapshot': None, 'ts': time.time()}
 
         # Logic
         while self.running:
             try:
-                string = check_queue.get(block=True, timeout=None)
+                batch = check_queue.get(block=True, timeout=None)
             except EOFError:
                 break
 
-            if string is not None:
-
-                for check in Check.parse(
-                    string, self.freshness_factor, self.log
-                ):
-
-                    for backend in backends:
-                        send_lock.acquire()
-                        backend._process(check)
-                        send_lock.release()
+            if report:
+                self._report_ring(check_queue, ring_state)
+            if self.trace is not None:
+                self._report_trace(trace_state)
+            if not self.decode_workers:
+                self.registry.set(
+                    'input_queue_fill', self._queue_fill(check_queue))
 
-                        if (self.ttl and len(backend.checks) > 0 and
-                           (not backend.ttl_thread or
-                           not backend.ttl_thread.isAlive())):
-                            backend.ttl_thread = Thread(
-                                target=ttl_thread, args=(self.ttl, backend))
-                            backend.ttl_thread.daemon = True
-                            backend.ttl_thread.start()
-
-                check_queue.task_done()
-
-            else:
+            if batch is None:
                 # Terminate branch
                 self.running = False
+                scheduler.stop()
                 for backend in backends:
                     backend._flush()
                 self.log.debug('Backends flushed')
+                continue
+
+            if self.decode_workers:
+                # Already parsed by decoders
+                checks = batch
+            else:
+                checks = self._safe_parse(batch)
+            self.registry.inc('input_checks', len(checks))
+
+            if self.trace is not None:
+                join_ts = time.time()
+                for check in checks:
+                    check.join_ts = join_ts
+                self.trace.add(
+                    'join', [join_ts - check.parsing_ts for check in checks])
+
+            for backend in backends:
+                send_lock.acquire()
+                backend._process_batch(checks)
+                send_lock.release()
+
+                scheduler.schedule(backend)
+
+            check_queue.task_done()
 
         self.log.info("Exit")
 
+    def input_decoder(self, check_queue, backend_queue, worker):
+        """
+        Parse lines batches to checks batches (for Input_Backend)
+        """
+        if setproctitle:
+            setproctitle('%s - Input_Decoder_%d' % (getproctitle(), worker))
+
+        # Ignore signals / stop triggered by Input main thread
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        stats = {'decode_errors': 0, 'check_errors': 0}
+        reported = dict(stats)
+        report_ts = time.time()
+
+        # Ring queue state reporting (first decoder only)
+        report = hasattr(check_queue, 'stats') and worker == 0
+        ring_state = {'drops': 0, 'ts': time.time()}
+
+        while True:
+            try:
+                batch = check_queue.get(block=True, timeout=None)
+            except EOFError:
+                break
+
+            if batch is None:
+                break
+
+            if report:
+                self._report_ring(check_queue, ring_state)
+            if worker == 0:
+                self.registry.set(
+                    'input_queue_fill', self._queue_fill(check_queue))
+
+            checks = self._safe_parse(batch, stats)
+
+            if len(checks) > 0:
+                backend_queue.put(checks)
+
+            check_queue.task_done()
+
+            # Report errors (at most every minute)
+            if (stats != reported and
+                    time.time() - report_ts > REPORT_INTERVAL):
+                self.log.info(
+                    'Input_Decoder_%d: %d decode errors, '
+                    '%d invalid checks' % (
+                        worker, stats['decode_errors'],
+                        stats['check_errors']))
+                reported = dict(stats)
+                report_ts = time.time()
+
+        self.log.info(
+            'Input_Decoder_%d: exit with %d decode errors, '
+            '%d invalid checks' % (
+                worker, stats['decode_errors'], stats['check_errors']))
+        self._terminate(self.decoders_alive, backend_queue, 1)
+
+    def _safe_parse(self, batch, stats=None):
+        """
+        Parse a lines batch, a failing batch is counted and skipped
+        (worker process keeps running)
+        """
+        try:
+            return self._parse(batch, stats)
+        except:
+            if stats is not None:
+                stats['decode_errors'] += 1
+            self.registry.inc('input_decode_errors')
+            self.log.error('Failed to parse a batch, skipped')
+            self.log.debug(traceback.format_exc())
+            return []
+
+    def _parse(self, batch, stats=None):
+        """
+        Parse a lines batch to checks
+        Account its listener, queue and parsing stages (traced batch)
+        """
+        get_ts = time.time()
+        stamps = Trace.split(batch)
+
+        if stats is None:
+            stats = {'decode_errors': 0, 'check_errors': 0}
+        errors = stats['decode_errors'] + stats['check_errors']
+
+        checks = []
+        for line in batch:
+            checks.extend(Check.parse(
+                line, self.freshness_factor, self.log, stats))
+
+        errors = stats['decode_errors'] + stats['check_errors'] - errors
+        if errors:
+            self.registry.inc('input_decode_errors', errors)
+
+        if stamps is not None and self.trace is not None and checks:
+            read_ts, queued_ts = stamps
+            for check in checks:
+                check.read_ts = read_ts
+            count = len(checks)
+            self.trace.add_same('batch', queued_ts - read_ts, count)
+            self.trace.add_same('queue', get_ts - queued_ts, count)
+            self.trace.add_same('parse', time.time() - get_ts, count)
+
+        return checks
+
+    def _report_trace(self, state):
+        """
+        Log checks latency by stage (every minute, since last report)
+        """
+        if time.time() - state['ts'] < REPORT_INTERVAL:
+            return
+
+        snapshot = self.trace.snapshot()
+        for stats in self.trace.stats(snapshot, state['snapshot']):
+            if stats['count']:
+                self.log.info(
+                    'Input latency %(stage)s: %(count)d checks, '
+                    'avg %(avg).3fs, p50 %(p50).3fs, p90 %(p90).3fs, '
+                    'p99 %(p99).3fs' % stats)
+        state['snapshot'] = snapshot
+        state['ts'] = time.time()
+
+    def _report_ring(self, ring, state):
+        """
+        Log ring queue fill and drops (every minute)
+        """
+        if time.time() - state['ts'] < REPORT_INTERVAL:
+            return
+
+        stats = ring.stats()
+        self.log.info(
+            'Input ring: %d%% used, %d records, %d dropped' % (
+                100 * stats['used'] / stats['size'],
+                stats['records'], stats['drops'] - state['drops']))
+        state['drops'] = stats['drops']
+        state['ts'] = time.time()
+
+    def rebuilds(self, backends):
+        """
+        Run backends rebuilds on startup, then on their requested delays
+        """
+        due = [[time.time(), backend] for backend in backends]
+        while self.running and due:
+            for entry in due[:]:
+                if entry[0] > time.time():
+                    continue
+                delay = entry[1]._rebuild()
+                if delay is None:
+                    due.remove(entry)
+                else:
+                    entry[0] = time.time() + delay
+
+            time.sleep(REBUILD_TICK)
+
+    def freshness_deadlines(self, backends, send_lock):
+        """
+        Outdate checks once their freshness deadline passed (heap mode)
+        Deadlines of stored checks are loaded on startup (retried)
+        """
+        start_time = time.time()
+        seeding = list(backends)
+
+        while self.running:
+            for backend in seeding[:]:
+                if backend._seed(OUTDATED_PREFIX, start_time):
+                    seeding.remove(backend)
+
+            deadlines = 0
+            for backend in backends:
+                # By batches (releasing lock for checks processing)
+                expired = EXPIRE_BATCH
+                while expired == EXPIRE_BATCH:
+                    with send_lock:
+                        expired = backend._expire(
+                            time.time(), OUTDATED_STATUS, OUTDATED_PREFIX,
+                            EXPIRE_BATCH)
+                deadlines += len(backend.deadlines)
+            self.registry.set('freshness_deadlines', deadlines)
+
+            time.sleep(FRESHNESS_TICK)
+
     def freshness_worker(self):
         # Save current time (startup grace)
         start_time = time.time()
@@ -227,6 +1002,7 @@ class InputServer(object):
                 cls = load_backend('input', backend)
                 backends.append(
                     cls(self.config['backends'].get(backend, None)))
+                backends[-1].registry = self.registry
             except:
                 self.log.error('Error loading backend %s' % backend)
                 self.log.debug(traceback.format_exc())
@@ -234,22 +1010,58 @@ class InputServer(object):
             self.log.critical('No available backends')
             return
 
+        # Partitions handled by backend (logged on change)
+        handled = {}
+
         while True:
             self.log.debug('Run update')
 
             start = int(time.time())
 
             for backend in backends:
-                backend.freshness(
-                    2, 'OUTDATED - ', start_time, self.freshness_interval)
+                shares = None
+                if self.freshness_partition:
+                    shares = self._freshness_partitions(backend, handled)
+
+                if self.freshness_mode == 'update_by_query':
+                    backend.freshness_by_query(
+                        OUTDATED_STATUS, OUTDATED_PREFIX, start_time,
+                        shares)
+                else:
+                    backend.freshness(
+                        OUTDATED_STATUS, OUTDATED_PREFIX, start_time,
+                        self.freshness_interval, shares)
 
             self.log.debug('End update')
+            self.registry.inc('freshness_runs')
+            self.registry.set('freshness_duration', time.time() - start)
 
             exec_time = int(time.time()) - start
 
             if exec_time < self.freshness_interval:
                 time.sleep(self.freshness_interval - exec_time)
 
+    def _freshness_partitions(self, backend, handled):
+        """
+        Renew this Input partition lease, take over orphan partitions
+        Return (partitions, count), own partition only if leases fail
+        """
+        index, count = self.freshness_partition
+        live = backend.lease(
+            index, count, FRESHNESS_LEASE * self.freshness_interval)
+        if live is None:
+            shares = [index]
+        else:
+            shares = partitions(index, count, live)
+
+        name = backend.__class__.__name__
+        if handled.get(name) != shares:
+            self.log.info(
+                '%s: freshness partitions %s of %d' % (
+                    name, ', '.join(str(share) for share in shares), count))
+            handled[name] = shares
+        return (shares, count)
+
     def input_freshness(self):
         if setproctitle:
             setproctitle('%s - Input_Freshness' % getproctitle())
@@ -0,0 +1,182 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import os
+import struct
+import logging
+import traceback
+
+from six.moves import cPickle as pickle
+
+# Record header : payload length
+HEADER = struct.Struct('!I')
+
+# Maximum segment file size (rolled after)
+SEGMENT_BYTES = 16777216
+SEGMENT_SUFFIX = '.spool'
+
+
+class Spool(object):
+    """
+    Disk spool of checks (append only segment files, FIFO)
+    Hold checks backends can not send (overflow), to replay them in order
+
+    Segments are <path>/<sequence>.spool holding length-prefixed pickled
+    checks. Oldest segments are dropped above max_bytes. Read segments
+    are removed once fully replayed.
+
+    fsync policy :
+        always : after each append
+        segment : when segment is rolled / closed
+        never : let system write it
+    """
+
+    def __init__(self, path, max_bytes, fsync='segment'):
+        self.log = logging.getLogger('tantale.input')
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.segment_bytes = max(1, min(SEGMENT_BYTES, max_bytes // 4))
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # Segments sequences (oldest first) and sizes
+        self.segments = []
+        self.sizes = {}
+        for name in os.listdir(path):
+            if name.endswith(SEGMENT_SUFFIX):
+                seq = int(name[:-len(SEGMENT_SUFFIX)])
+                self.segments.append(seq)
+                self.sizes[seq] = os.path.getsize(self._name(seq))
+        self.segments.sort()
+
+        self.dropped = 0
+
+        self.writer = None
+        self.reader = None
+        self.reader_seq = None
+
+        if self.segments:
+            self.log.info(
+                'Spool: %d segments (%d bytes) to replay from %s' % (
+                    len(self.segments), self.size(), path))
+
+    def _name(self, seq):
+        return os.path.join(self.path, '%020d%s' % (seq, SEGMENT_SUFFIX))
+
+    def size(self):
+        return sum(self.sizes.values())
+
+    def empty(self):
+        return len(self.segments) == 0
+
+    def append(self, checks):
+        """
+        Append checks at end of spool
+        """
+        data = b''.join(
+            HEADER.pack(len(payload)) + payload
+            for payload in (pickle.dumps(check, 2) for check in checks))
+        if not data:
+            return
+
+        if self.writer is None or \
+           self.sizes[self.segments[-1]] >= self.segment_bytes:
+            self._roll()
+
+        self.writer.write(data)
+        self.writer.flush()
+        if self.fsync == 'always':
+            os.fsync(self.writer.fileno())
+
+        self.sizes[self.segments[-1]] += len(data)
+
+        # Size cap - drop oldest (not being written)
+        while self.size() > self.max_bytes and len(self.segments) > 1:
+            self._drop(self.segments[0])
+
+    def read(self, count):
+        """
+        Read (and remove) up to count checks from start of spool
+        """
+        checks = []
+        while len(checks) < count and self.segments:
+            seq = self.segments[0]
+            if self.reader_seq != seq:
+                self.reader = open(self._name(seq), 'rb')
+                self.reader_seq = seq
+
+            header = self.reader.read(HEADER.size)
+            if len(header) == HEADER.size:
+                length = HEADER.unpack(header)[0]
+                payload = self.reader.read(length)
+                if len(payload) == length:
+                    try:
+                        checks.append(pickle.loads(payload))
+                    except:
+                        self.log.warn('Spool: invalid record skipped')
+                        self.log.debug(traceback.format_exc())
+                    continue
+
+            # End of segment (or truncated record, interrupted write)
+            # Next append starts a new one if it was being written
+            self._drop(seq, replayed=True)
+
+        return checks
+
+    def close(self):
+        if self.writer is not None:
+            self._close_writer()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+            self.reader_seq = None
+
+    def _roll(self):
+        """
+        Start a new segment
+        """
+        if self.writer is not None:
+            self._close_writer()
+
+        seq = 0
+        if self.segments:
+            seq = self.segments[-1] + 1
+        self.writer = open(self._name(seq), 'ab')
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+
+    def _close_writer(self):
+        self.writer.flush()
+        if self.fsync != 'never':
+            os.fsync(self.writer.fileno())
+        self.writer.close()
+        self.writer = None
+
+    def _drop(self, seq, replayed=False):
+        """
+        Remove a segment
+        """
+        if seq == self.reader_seq:
+            self.reader.close()
+            self.reader = None
+            self.reader_seq = None
+        if self.writer is not None and seq == self.segments[-1]:
+            self.writer.close()
+            self.writer = None
+
+        if not replayed:
+            self.dropped += 1
+            self.log.warn(
+                'Spool: size cap reached, dropping segment %d (%d bytes)' % (
+                    seq, self.sizes[seq]))
+
+        self.segments.remove(seq)
+        del self.sizes[seq]
+        try:
+            os.unlink(self._name(seq))
+        except OSError:
+            pass
@@ -0,0 +1,105 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+import logging
+from collections import defaultdict
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from tantale.input.server import Batcher, Connection
+
+
+class BatcherTC(unittest.TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('tantale.input')
+        self.origin = Connection(None, ('127.0.0.1', 0), defaultdict(int))
+
+    def batcher(self, queue, keep=False, **kwargs):
+        options = {'max_lines': 3, 'max_bytes': 1024, 'delay': 0.05}
+        options.update(kwargs)
+        return Batcher(
+            queue, options['max_lines'], options['max_bytes'],
+            options['delay'], keep, self.log)
+
+    def test_FlushLines(self):
+        queue = Queue()
+        batcher = self.batcher(queue)
+        for i in range(7):
+            batcher.add(b'line', self.origin)
+
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.get(), [b'line'] * 3)
+        self.assertEqual(len(batcher.lines), 1)
+
+    def test_FlushBytes(self):
+        queue = Queue()
+        batcher = self.batcher(queue, max_bytes=10)
+        batcher.add(b'x' * 6, self.origin)
+        self.assertTrue(queue.empty())
+        batcher.add(b'x' * 6, self.origin)
+        self.assertEqual(queue.get(), [b'x' * 6] * 2)
+        self.assertEqual(batcher.size, 0)
+
+    def test_Timeout(self):
+        queue = Queue()
+        batcher = self.batcher(queue)
+        self.assertEqual(batcher.timeout(), -1)
+
+        batcher.add(b'line', self.origin)
+        self.assertTrue(0 < batcher.timeout() <= 0.05)
+        time.sleep(0.06)
+        self.assertEqual(batcher.timeout(), 0)
+
+        batcher.flush()
+        self.assertEqual(queue.get(), [b'line'])
+        self.assertEqual(batcher.timeout(), -1)
+
+    def test_Drop(self):
+        queue = Queue(1)
+        batcher = self.batcher(queue, max_lines=2)
+        for i in range(4):
+            batcher.add(b'line', self.origin)
+
+        # Second batch dropped, counted on its connection
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(batcher.lines, [])
+        self.assertEqual(self.origin.dropped, 2)
+        self.assertEqual(self.origin.stats['dropped'], 2)
+
+    def test_Keep(self):
+        queue = Queue(1)
+        batcher = self.batcher(queue, keep=True, max_lines=2)
+        for i in range(4):
+            batcher.add(b'line', self.origin)
+
+        # Backpressure : full queue keeps batch for a later retry
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(len(batcher.lines), 2)
+        self.assertTrue(batcher.timeout() > 0)
+        self.assertEqual(self.origin.dropped, 0)
+
+        queue.get()
+        batcher.flush()
+        self.assertEqual(queue.get(), [b'line'] * 2)
+        self.assertEqual(batcher.lines, [])
+
+    def test_KeepExit(self):
+        queue = Queue(1)
+        queue.put([b'other'])
+        batcher = self.batcher(queue, keep=True)
+        batcher.add(b'line', self.origin)
+
+        # Blocking flush (exit) drops batch after timeout
+        batcher.flush(0.01)
+        self.assertEqual(batcher.lines, [])
+        self.assertEqual(self.origin.dropped, 1)
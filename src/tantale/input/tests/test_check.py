@@ -0,0 +1,64 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import json
+import logging
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.input.check import Check
+
+
+class CheckParseTC(unittest.TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('tantale.input')
+        self.stats = {'decode_errors': 0, 'check_errors': 0}
+
+    def parse(self, value):
+        return list(Check.parse(json.dumps(value), 2, self.log, self.stats))
+
+    def test_Envelope(self):
+        checks = self.parse({
+            "hostname": "host", "timestamp": 10, "interval": 5,
+            "checks": [
+                {"check": "Host", "status": 0, "output": "up"},
+                {"check": "load", "status": 2, "output": "high"},
+            ]})
+        self.assertEqual([check.id for check in checks], ['host', 'host-load'])
+        self.assertEqual(checks[1].freshness, 20)
+        self.assertEqual(self.stats['check_errors'], 0)
+
+    def test_List(self):
+        check = {
+            "hostname": "host", "check": "Host", "timestamp": 10,
+            "interval": 5, "status": 0, "output": "up"}
+        self.assertEqual(len(self.parse([check, check])), 2)
+
+    def test_InvalidEnvelopes(self):
+        valid = {
+            "hostname": "host", "timestamp": 10, "interval": 5,
+            "checks": [{"check": "Host", "status": 0, "output": "up"}]}
+        invalid = [
+            {"hostname": "host", "checks": 5},
+            {"hostname": "host", "checks": None},
+            {"hostname": "host", "checks": [1]},
+            {"hostname": "host", "checks": {"check": "x"}},
+        ]
+        checks = self.parse(invalid + [valid])
+
+        # Bad envelopes counted, next ones parsed
+        self.assertEqual(self.stats['check_errors'], len(invalid))
+        self.assertEqual([check.id for check in checks], ['host'])
+
+    def test_InvalidChecks(self):
+        self.assertEqual(self.parse([1, "x", {"check": "Host"}]), [])
+        self.assertEqual(self.stats['check_errors'], 3)
+
+    def test_InvalidJSON(self):
+        self.assertEqual(
+            list(Check.parse('{"check', 2, self.log, self.stats)), [])
+        self.assertEqual(self.stats['decode_errors'], 1)
@@ -0,0 +1,85 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale import codec
+
+
+def check_payload(host, service):
+    """
+    Check as sent by clients
+    """
+    return {
+        "check": "service_%d" % service,
+        "status": service % 4,
+        "timestamp": 1460000000 + service,
+        "contacts": ["user_1", "user_%d" % host],
+        "hostname": "host_%d.domain" % host,
+        "output": "Disk / : 42.5%% used (%d, 80.0, 90.0, None, None)" % host,
+        "interval": 60,
+    }
+
+
+def envelope_payload(host, services):
+    """
+    Host checks in an envelope
+    """
+    return {
+        "hostname": "host_%d.domain" % host,
+        "contacts": ["user_1", "user_%d" % host],
+        "interval": 60,
+        "timestamp": 1460000000,
+        "checks": [
+            dict((key, value)
+                 for key, value in check_payload(host, service).items()
+                 if key not in ('hostname', 'contacts', 'interval'))
+            for service in range(services)
+        ],
+    }
+
+
+class CodecTC(unittest.TestCase):
+    bench = False
+
+    def test_RoundTrip(self):
+        payloads = [check_payload(1, 1), envelope_payload(2, 5),
+                    {"output": u"Unicode é / \"quoted\"\n"}]
+        for name, (dumps, dumpb, loads) in codec.CODECS.items():
+            for payload in payloads:
+                self.assertEqual(loads(dumps(payload)), payload, name)
+                self.assertEqual(loads(dumpb(payload)), payload, name)
+                self.assertEqual(
+                    loads(dumpb(payload).decode('utf-8')), payload, name)
+
+    def test_Bench(self):
+        """
+        Compare codecs on checks lines (encode / decode)
+        """
+        if not self.bench:
+            return
+
+        lines = [check_payload(host, service)
+                 for host in range(500) for service in range(15)]
+        lines += [envelope_payload(host, 15) for host in range(500)]
+
+        print("")
+        for name, (dumps, dumpb, loads) in codec.CODECS.items():
+            start = time.time()
+            encoded = [dumpb(line) for line in lines]
+            encode = time.time() - start
+
+            start = time.time()
+            for line in encoded:
+                loads(line)
+            decode = time.time() - start
+
+            print(
+                "%s: %d lines encoded in %f seconds, decoded in %f seconds" %
+                (name, len(lines), encode, decode))
@@ -0,0 +1,46 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+from collections import defaultdict
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.input import server
+from tantale.input.server import Connection
+
+
+class ConnectionTC(unittest.TestCase):
+    def setUp(self):
+        self.conn = Connection(None, ('127.0.0.1', 0), defaultdict(int))
+
+    def test_Lines(self):
+        self.assertEqual(
+            self.conn.feed(b'{"a": 1}\n{"b": 2}\n'),
+            [b'{"a": 1}', b'{"b": 2}'])
+        self.assertEqual(len(self.conn.buffer), 0)
+        self.assertFalse(self.conn.binary)
+
+    def test_Partial(self):
+        self.assertEqual(self.conn.feed(b'{"a": '), [])
+        self.assertEqual(self.conn.feed(b'1}\n{"b"'), [b'{"a": 1}'])
+        self.assertEqual(self.conn.feed(b': 2}\n'), [b'{"b": 2}'])
+        self.assertEqual(len(self.conn.buffer), 0)
+
+    def test_EmptyLines(self):
+        self.assertEqual(self.conn.feed(b'\n\nx\n\n'), [b'x'])
+
+    def test_NoMemoryview(self):
+        # Python 2.6 : lines copied out of buffer
+        builtin = 'memoryview' not in vars(server)
+        server.memoryview = None
+        try:
+            self.assertEqual(
+                self.conn.feed(bytearray(b'a\nbc\nd')), [b'a', b'bc'])
+            self.assertEqual(self.conn.feed(b'\n'), [b'd'])
+        finally:
+            if builtin:
+                del server.memoryview
@@ -0,0 +1,25 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.input.freshness import partitions
+
+
+class PartitionsTC(unittest.TestCase):
+    def test_AllLive(self):
+        for index in range(4):
+            self.assertEqual(partitions(index, 4, range(4)), [index])
+
+    def test_Takeover(self):
+        # Partitions 2 and 3 orphans, spread over live ones
+        self.assertEqual(partitions(0, 4, [0, 1]), [0, 2])
+        self.assertEqual(partitions(1, 4, [0, 1]), [1, 3])
+
+    def test_NoLease(self):
+        # Own lease missing (not renewed yet), still handled
+        self.assertEqual(partitions(2, 3, []), [2, 0, 1])
@@ -0,0 +1,83 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+from collections import defaultdict
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.input.check import Check
+from tantale.input.server import Connection
+from tantale.protocol import msgpack, StringTable, resolve, BINARY_MAGIC
+
+
+class NullLog(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+@unittest.skipIf(msgpack is None, 'msgpack module not available')
+class ProtocolTC(unittest.TestCase):
+    checks = [
+        {'hostname': 'host', 'check': 'cpu', 'status': 0, 'timestamp': 1,
+         'interval': 60, 'contacts': ['ops', 'dev']},
+        {'hostname': 'host', 'check': 'mem', 'status': 2, 'timestamp': 1,
+         'interval': 60, 'contacts': ['ops']},
+    ]
+
+    def test_StringTable(self):
+        table = StringTable()
+        table.frame(self.checks)
+        self.assertEqual(
+            sorted(table.index), ['cpu', 'dev', 'host', 'mem', 'ops'])
+        self.assertEqual(table.pending, [])
+
+        # Known strings are not sent again
+        payload = table.frame(self.checks)[4:]
+        strings, refs = msgpack.unpackb(payload, raw=False)
+        self.assertEqual(strings, [])
+        self.assertEqual(refs[0]['hostname'], table.index['host'])
+
+    def test_Resolve(self):
+        strings = ['host', 'cpu', 'ops']
+        envelope = {'hostname': 0, 'checks': [
+            {'check': 1, 'status': 0, 'contacts': [2, 'dev']}]}
+        self.assertEqual(resolve(strings, [envelope]), [{
+            'hostname': 'host', 'checks': [
+                {'check': 'cpu', 'status': 0, 'contacts': ['ops', 'dev']}]}])
+
+    def test_Frames(self):
+        table = StringTable()
+        conn = Connection(None, ('127.0.0.1', 0), defaultdict(int))
+        data = BINARY_MAGIC + table.frame(self.checks) + \
+            table.frame(self.checks[1:])
+
+        # Partial frame is kept until complete
+        self.assertEqual(conn.feed(data[:10]), [])
+        records = conn.feed(data[10:])
+        self.assertTrue(conn.binary)
+        self.assertEqual(records, [self.checks, self.checks[1:]])
+        self.assertEqual(len(conn.sizes), 2)
+        self.assertEqual(len(conn.buffer), 0)
+
+        checks = list(Check.parse(records[0], 2, NullLog()))
+        self.assertEqual([c.check for c in checks], ['cpu', 'mem'])
+        self.assertEqual(checks[0].contacts, ['ops', 'dev'])
+
+    def test_Repack(self):
+        table = StringTable()
+        conn = Connection(
+            None, ('127.0.0.1', 0), defaultdict(int), repack=True)
+        records = conn.feed(BINARY_MAGIC + table.frame(self.checks))
+        self.assertEqual(records[0][:1], BINARY_MAGIC)
+
+        checks = list(Check.parse(records[0], 2, NullLog()))
+        self.assertEqual([c.check for c in checks], ['cpu', 'mem'])
+
+    def test_TooLarge(self):
+        conn = Connection(None, ('127.0.0.1', 0), defaultdict(int))
+        with self.assertRaises(ValueError):
+            conn.feed(BINARY_MAGIC + b'\xff\xff\xff\xff')
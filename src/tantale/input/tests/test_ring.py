@@ -0,0 +1,102 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import logging
+from collections import defaultdict
+from multiprocessing import Process
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+try:
+    from Queue import Full, Empty
+except ImportError:
+    from queue import Full, Empty
+
+from tantale.input.ring import RingQueue, HEADER
+from tantale.input.server import Batcher, Connection
+
+
+class RingQueueTC(unittest.TestCase):
+    def test_Records(self):
+        ring = RingQueue(1024)
+        ring.put([b'a', b'', b'bcd'])
+        ring.put([b'e'])
+        self.assertEqual(ring.qsize(), 2)
+        self.assertEqual(ring.get(), [b'a', b'', b'bcd'])
+        self.assertEqual(ring.get(), [b'e'])
+        self.assertTrue(ring.empty())
+        self.assertRaises(Empty, ring.get_nowait)
+        self.assertEqual(ring.fill(), 0)
+
+    def test_Sentinel(self):
+        ring = RingQueue(64)
+        ring.put([b'x'])
+        ring.put(None)
+        self.assertEqual(ring.get(), [b'x'])
+        self.assertEqual(ring.get(), None)
+
+    def test_Wraparound(self):
+        # Records crossing ring end many times
+        record = 2 * HEADER.size + 7
+        ring = RingQueue(3 * record - 5)
+        for i in range(50):
+            item = [('%07d' % i).encode('ascii')]
+            ring.put(item)
+            ring.put(item)
+            self.assertEqual(ring.get(), item)
+            self.assertEqual(ring.get(), item)
+        self.assertEqual(ring.stats()['used'], 0)
+
+    def test_Full(self):
+        ring = RingQueue(32)
+        ring.put([b'x' * 16])
+        self.assertRaises(Full, ring.put_nowait, [b'y' * 16])
+        self.assertRaises(Full, ring.put, [b'y' * 16], True, 0.01)
+        # Too large
+        self.assertRaises(Full, ring.put, [b'z' * 64], False)
+
+        # Full is not a drop (producer may retry)
+        self.assertEqual(ring.stats()['drops'], 0)
+        ring.drop()
+        self.assertEqual(ring.stats()['drops'], 1)
+
+    def test_Processes(self):
+        ring = RingQueue(256)
+
+        def produce():
+            for i in range(200):
+                ring.put([str(i).encode('ascii')])
+            ring.put(None)
+
+        process = Process(target=produce)
+        process.start()
+        received = []
+        while True:
+            item = ring.get(timeout=5)
+            if item is None:
+                break
+            received.extend(item)
+        process.join()
+        self.assertEqual(
+            received, [str(i).encode('ascii') for i in range(200)])
+
+    def test_BatcherDrops(self):
+        log = logging.getLogger('tantale.input')
+        origin = Connection(None, ('127.0.0.1', 0), defaultdict(int))
+        ring = RingQueue(32)
+        ring.put([b'x' * 16])
+
+        # Kept (backpressure), retries are not drops
+        batcher = Batcher(ring, 1, 1024, 0, True, log)
+        batcher.add(b'y' * 16, origin)
+        batcher.flush()
+        self.assertEqual(ring.stats()['drops'], 0)
+
+        # Dropped
+        batcher.flush(timeout=0.01)
+        self.assertEqual(ring.stats()['drops'], 1)
+        self.assertEqual(origin.dropped, 1)
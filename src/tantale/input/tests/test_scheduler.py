@@ -0,0 +1,101 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+import logging
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.input.scheduler import FlushScheduler
+
+
+class Check(object):
+    def __init__(self):
+        self.parsing_ts = time.time()
+
+
+class BatchBackend(object):
+    """
+    Backend sending batch checks by send, failing after fail_after sends
+    """
+    ttl = None
+
+    def __init__(self, checks, batch=10, fail_after=None):
+        self.checks = [Check() for i in range(checks)]
+        self.batch = batch
+        self.fail_after = fail_after
+        self.sends = 0
+        self.sent = threading.Event()
+
+    def spooled(self):
+        return False
+
+    def send(self):
+        self.sends += 1
+        if self.fail_after is None or self.sends <= self.fail_after:
+            self.checks = self.checks[self.batch:]
+        self.sent.set()
+
+
+class FlushSchedulerTC(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = FlushScheduler(
+            0.05, threading.Lock(), logging.getLogger('tantale.input'))
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_Ttl(self):
+        backend = BatchBackend(5)
+        self.scheduler.schedule(backend)
+        self.assertFalse(backend.sent.wait(0.02))
+        self.assertTrue(backend.sent.wait(1))
+        self.assertEqual(backend.checks, [])
+
+    def test_BackendTtl(self):
+        backend = BatchBackend(5)
+        backend.ttl = 10
+        self.scheduler.schedule(backend)
+        self.assertFalse(backend.sent.wait(0.2))
+
+    def test_Earliest(self):
+        backend = BatchBackend(5)
+        self.scheduler.schedule(backend, time.time() + 10)
+        self.scheduler.schedule(backend, time.time() + 0.01)
+        self.scheduler.schedule(backend, time.time() + 20)
+        self.assertTrue(backend.sent.wait(1))
+
+    def test_Empty(self):
+        backend = BatchBackend(0)
+        self.scheduler.schedule(backend)
+        self.assertEqual(self.scheduler.deadlines, {})
+
+    def test_Flush(self):
+        # Forced send drains all pending checks
+        backend = BatchBackend(35)
+        backend.ttl = 10
+        self.scheduler.flush(backend)
+        self.assertTrue(backend.sent.wait(1))
+        # Wait drain end (sending under lock)
+        with self.scheduler.lock:
+            pass
+        self.assertEqual(backend.checks, [])
+        self.assertEqual(backend.sends, 4)
+
+    def test_FlushFailure(self):
+        # Drain stops once a send makes no progress, retried after ttl
+        backend = BatchBackend(35, fail_after=1)
+        backend.ttl = 10
+        self.scheduler.flush(backend)
+        self.assertTrue(backend.sent.wait(1))
+        # Wait drain end (sending under lock)
+        with self.scheduler.lock:
+            pass
+        self.assertEqual(len(backend.checks), 25)
+        self.assertEqual(backend.sends, 2)
+        self.assertTrue(id(backend) in self.scheduler.deadlines)
@@ -0,0 +1,115 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.input.scheduler import FlushScheduler
+from tantale.input.spool import Spool
+
+
+class SpoolTC(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_FIFO(self):
+        spool = Spool(self.path, 1024 * 1024)
+        self.assertTrue(spool.empty())
+        spool.append(range(10))
+        spool.append(range(10, 15))
+
+        self.assertEqual(spool.read(4), [0, 1, 2, 3])
+        self.assertEqual(spool.read(100), list(range(4, 15)))
+        self.assertTrue(spool.empty())
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_Segments(self):
+        # 4 segments of 64 bytes
+        spool = Spool(self.path, 256)
+        for i in range(20):
+            spool.append(['check %d' % i])
+        self.assertTrue(len(spool.segments) > 1)
+        self.assertTrue(spool.size() <= 256)
+
+        # Oldest segments dropped, order kept
+        checks = spool.read(100)
+        self.assertTrue(spool.dropped > 0)
+        self.assertEqual(checks[-1], 'check 19')
+        self.assertEqual(
+            checks, ['check %d' % i for i in range(20 - len(checks), 20)])
+
+    def test_Reopen(self):
+        spool = Spool(self.path, 1024 * 1024)
+        spool.append(['a', 'b', 'c'])
+        self.assertEqual(spool.read(1), ['a'])
+        spool.close()
+
+        # Unread segment replayed (from its start) after restart
+        spool = Spool(self.path, 1024 * 1024)
+        self.assertFalse(spool.empty())
+        self.assertEqual(spool.read(10), ['a', 'b', 'c'])
+        spool.append(['d'])
+        self.assertEqual(spool.read(10), ['d'])
+
+
+class SpooledBackend(object):
+    """
+    Backend only holding spooled checks, replayed by send
+    """
+    ttl = None
+
+    def __init__(self, spooled):
+        self.checks = []
+        self.spooled_checks = spooled
+        self.sent = threading.Event()
+
+    def spooled(self):
+        return self.spooled_checks > 0
+
+    def send(self):
+        self.spooled_checks -= 1
+        if not self.spooled_checks:
+            self.sent.set()
+
+
+class ReplayTC(unittest.TestCase):
+    def test_Replay(self):
+        # No incoming checks, spool replayed by scheduler
+        scheduler = FlushScheduler(
+            0.01, threading.Lock(), logging.getLogger('tantale.input'))
+        backend = SpooledBackend(2)
+        try:
+            scheduler.flush(backend)
+            self.assertTrue(backend.sent.wait(5))
+        finally:
+            scheduler.stop()
+
+        self.assertFalse(backend.spooled())
+        self.assertEqual(scheduler.deadlines, {})
+
+    def test_Idle(self):
+        scheduler = FlushScheduler(
+            0.01, threading.Lock(), logging.getLogger('tantale.input'))
+        backend = SpooledBackend(0)
+        scheduler.schedule(backend)
+        scheduler.stop()
+        self.assertEqual(scheduler.heap, [])
+
+        # Spooled checks get a replay deadline
+        backend.spooled_checks = 1
+        before = time.time()
+        scheduler.schedule(backend)
+        self.assertTrue(scheduler.heap[0][0] > before)
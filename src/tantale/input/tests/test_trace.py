@@ -0,0 +1,46 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.input.trace import Trace
+
+
+class TraceTC(unittest.TestCase):
+    def test_Trailer(self):
+        batch = [b'{"check": "Host"}', Trace.trailer(10.5, 11.25)]
+        self.assertEqual(Trace.split(batch), (10.5, 11.25))
+        self.assertEqual(batch, [b'{"check": "Host"}'])
+
+        # Not traced batch
+        self.assertEqual(Trace.split(batch), None)
+        self.assertEqual(batch, [b'{"check": "Host"}'])
+
+    def test_Histograms(self):
+        trace = Trace()
+        trace.add('bulk', [0.004] * 90 + [0.3] * 10)
+        trace.add_same('queue', 0.05, 10)
+
+        previous = trace.snapshot()
+        trace.add('bulk', [1.5])
+
+        stats = dict((stat['stage'], stat) for stat in trace.stats())
+        self.assertEqual(stats['bulk']['count'], 101)
+        self.assertEqual(stats['bulk']['p50'], 0.005)
+        self.assertEqual(stats['bulk']['p99'], 0.5)
+        self.assertEqual(stats['bulk']['max'], 1.5)
+        self.assertEqual(stats['queue']['count'], 10)
+        self.assertEqual(stats['queue']['avg'], 0.05)
+        self.assertEqual(stats['lag']['count'], 0)
+
+        # Since previous snapshot
+        stats = dict(
+            (stat['stage'], stat) for stat in
+            trace.stats(trace.snapshot(), previous))
+        self.assertEqual(stats['bulk']['count'], 1)
+        self.assertEqual(stats['bulk']['p50'], 1.5)
+        self.assertEqual(stats['queue']['count'], 0)
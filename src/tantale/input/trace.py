@@ -0,0 +1,174 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import struct
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+
+# Batch trailer record : read and queued timestamps
+# Magic byte never starts a JSON line nor a binary record
+TRACE_MAGIC = b'\xc0'
+TRACE_RECORD = struct.Struct('!dd')
+
+# Pipeline stages
+#   batch : first line read -> batch queued (listener batcher)
+#   queue : batch queued -> dequeued (by decoder or Input_Backend)
+#   parse : batch dequeued -> checks parsed
+#   join : check parsed -> joined to backend batch (decoders queue)
+#   pending : joined -> bulk sent (backend batch, backlog)
+#   bulk : bulk sent -> status acknowledged
+#   logs : status acknowledged -> logs written
+#   total : first line read -> status acknowledged
+#   lag : client timestamp -> status acknowledged (client clock)
+STAGES = (
+    'batch', 'queue', 'parse', 'join', 'pending', 'bulk', 'logs',
+    'total', 'lag',
+)
+
+# Histograms buckets upper bounds (seconds)
+BUCKETS = (
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+    1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+    float('inf'),
+)
+
+# Stage values : buckets counts, count, sum, max
+COUNT, SUM, MAX = range(len(BUCKETS), len(BUCKETS) + 3)
+WIDTH = len(BUCKETS) + 3
+
+# Reported quantiles
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Trace(object):
+    """
+    Checks latency by Input pipeline stage
+    Histograms in shared memory, updated by all Input processes and read
+    by Livestatus (latency table). Must be created before forking them.
+    """
+
+    def __init__(self):
+        self.values = RawArray('d', len(STAGES) * WIDTH)
+        self.lock = Lock()
+        self.offsets = dict(
+            (stage, i * WIDTH) for i, stage in enumerate(STAGES))
+
+    @staticmethod
+    def trailer(read_ts, queued_ts):
+        """
+        Batch trailer record (appended to lines batch)
+        """
+        return TRACE_MAGIC + TRACE_RECORD.pack(read_ts, queued_ts)
+
+    @staticmethod
+    def split(batch):
+        """
+        Remove trailer record of a lines batch
+        Return (read_ts, queued_ts), None if batch have no trailer
+        Batch may hold decoded records (not bytes), never trailers
+        """
+        if (
+            batch and isinstance(batch[-1], bytes) and
+            batch[-1][:1] == TRACE_MAGIC and
+            len(batch[-1]) == 1 + TRACE_RECORD.size
+        ):
+            return TRACE_RECORD.unpack(batch.pop()[1:])
+        return None
+
+    def add(self, stage, values):
+        """
+        Account durations (seconds) of a stage
+        """
+        if not values:
+            return
+
+        buckets = [0] * len(BUCKETS)
+        for value in values:
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+                    break
+
+        offset = self.offsets[stage]
+        with self.lock:
+            for i, count in enumerate(buckets):
+                if count:
+                    self.values[offset + i] += count
+            self.values[offset + COUNT] += len(values)
+            self.values[offset + SUM] += sum(values)
+            self.values[offset + MAX] = max(
+                self.values[offset + MAX], max(values))
+
+    def add_same(self, stage, value, count):
+        """
+        Account count checks with the same duration
+        """
+        if count <= 0:
+            return
+
+        offset = self.offsets[stage]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        with self.lock:
+            self.values[offset + i] += count
+            self.values[offset + COUNT] += count
+            self.values[offset + SUM] += value * count
+            self.values[offset + MAX] = max(
+                self.values[offset + MAX], value)
+
+    def snapshot(self):
+        """
+        Copy of histograms (consistent)
+        """
+        with self.lock:
+            return self.values[:]
+
+    def stats(self, snapshot=None, previous=None):
+        """
+        Stages statistics (dicts), of snapshot minus previous if given
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+
+        results = []
+        for stage in STAGES:
+            offset = self.offsets[stage]
+            values = snapshot[offset:offset + WIDTH]
+            if previous is not None:
+                values = [
+                    value - prev for value, prev in
+                    zip(values, previous[offset:offset + WIDTH])]
+                # Max since start only
+                values[MAX] = snapshot[offset + MAX]
+
+            result = {
+                'stage': stage,
+                'count': int(values[COUNT]),
+                'avg': 0,
+                'max': round(values[MAX], 3),
+            }
+            if values[COUNT]:
+                result['avg'] = round(values[SUM] / values[COUNT], 3)
+            for quantile in QUANTILES:
+                result['p%d' % (quantile * 100)] = self._quantile(
+                    values, quantile)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _quantile(values, quantile):
+        """
+        Bucket upper bound holding quantile (max for last bucket)
+        """
+        if not values[COUNT]:
+            return 0
+
+        rank = quantile * values[COUNT]
+        seen = 0
+        for i, bound in enumerate(BUCKETS):
+            seen += values[i]
+            if seen >= rank:
+                return round(min(bound, values[MAX]), 3)
+        return round(values[MAX], 3)
@@ -55,6 +55,31 @@ FIELDS_DUMMY = {
     "downtime_duration": 0,
 }
 
+# Host columns counting its services states (host document
+# service_states), column : counter
+SERVICES_COUNTERS = {
+    "num_services": "total",
+    "num_services_ok": "ok",
+    "num_services_warn": "warn",
+    "num_services_crit": "crit",
+    "num_services_unknown": "unknown",
+    "num_services_pending": "pending",
+    # No soft states
+    "num_services_hard_ok": "ok",
+    "num_services_hard_warn": "warn",
+    "num_services_hard_crit": "crit",
+    "num_services_hard_unknown": "unknown",
+    # Problems acknowledged or in downtime
+    "num_services_handled_problems": "handled",
+    "num_services_unhandled_problems": "unhandled",
+    "worst_service_state": "worst",
+    "worst_service_hard_state": "worst",
+}
+
+# Status names (counters) and order from best to worst
+SERVICES_STATES = ('ok', 'warn', 'crit', 'unknown')
+WORST_ORDER = (0, 1, 3, 2)
+
 # Data in status_table / Livestatus visible configuration
 STATUS_TABLE = {
     "livestatus_version": "tantale",
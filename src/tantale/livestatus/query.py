@@ -18,7 +18,7 @@ class Query(object):
         'output_sock', 'method', 'table',
         'columns', 'filters', 'stats', 'limit',
         'rheader', 'oformat', 'headers',
-        'separators', 'results',
+        'separators', 'results', 'trace', 'registry',
     ]
 
     def __init__(
@@ -41,6 +41,11 @@ class Query(object):
 
         self.results = []
 
+        # Input latency trace (latency table)
+        self.trace = None
+        # Processes metrics (status table)
+        self.registry = None
+
         # Remove None from filters
         self.filters = []
         if filters:
@@ -73,7 +78,18 @@ class Query(object):
         try:
             # status table / no backend query
             if self.table == "status":
-                self.append(STATUS_TABLE)
+                status = dict(STATUS_TABLE)
+                if self.registry is not None:
+                    status['program_start'] = self.registry.start
+                    status.update(self.registry.status())
+                self.append(status)
+                return
+
+            # latency table / Input checks latency by stage
+            elif self.table == "latency":
+                if self.trace is not None:
+                    for stats in self.trace.stats():
+                        self.append(stats)
                 return
 
             # commands table / no logic
@@ -120,6 +136,7 @@ class Query(object):
         """
         if self.columns:
             mapped_res = []
+            counters = None
             for req_field in self.columns:
                 # Remove object related prefix
                 if req_field.startswith("host_"):
@@ -143,6 +160,13 @@ class Query(object):
                     mapped_res.append(0)
                     continue
 
+                # Host services counters
+                elif self.table == 'hosts' and field in SERVICES_COUNTERS:
+                    if counters is None:
+                        counters = self._services_counters(result)
+                    mapped_res.append(counters[SERVICES_COUNTERS[field]])
+                    continue
+
                 elif field in result:
                     map_name = field
                 elif field in FIELDS_MAPPING:
@@ -209,6 +233,32 @@ class Query(object):
         if self.oformat == 'csv' and not self.rheader:
             self._output_line()
 
+    @staticmethod
+    def _services_counters(result):
+        """
+        Count host services by state (service_states of host document)
+        """
+        counters = dict((name, 0) for name in SERVICES_COUNTERS.values())
+        states = result.get('service_states') or {}
+        for state in states.values():
+            if not state or state.get('status') is None:
+                # Dropped
+                continue
+            status = state['status']
+            counters['total'] += 1
+            if 0 <= status < len(SERVICES_STATES):
+                counters[SERVICES_STATES[status]] += 1
+            if status != 0:
+                if state.get('ack') or state.get('downtime'):
+                    counters['handled'] += 1
+                else:
+                    counters['unhandled'] += 1
+            if status in WORST_ORDER and \
+               WORST_ORDER.index(status) > WORST_ORDER.index(
+                   counters['worst']):
+                counters['worst'] = status
+        return counters
+
     def _output_line(self):
         """
         Write a result line
@@ -3,6 +3,7 @@
 from __future__ import print_function
 
 import os
+import time
 import signal
 import traceback
 import logging
@@ -14,6 +15,8 @@ from threading import Thread, Event
 
 from tantale.utils import load_backend
 from tantale.livestatus.parser import Parser
+from tantale.livestatus.query import Query
+from tantale.metrics.registry import Registry
 
 try:
     from setproctitle import setproctitle, getproctitle
@@ -25,7 +28,7 @@ class LivestatusServer(object):
     """
     Listening thread for Input function
     """
-    def __init__(self, config):
+    def __init__(self, config, trace=None, registry=None):
         # Initialize Logging
         self.log = logging.getLogger('tantale.livestatus')
 
@@ -36,17 +39,40 @@ class LivestatusServer(object):
         self.config = config
         self.parser = Parser()
 
+        # Input checks latency (latency table), None if not traced
+        self.trace = trace
+
+        # Metrics (status table), not allocated (no op) if not given
+        if registry is None:
+            registry = Registry()
+        self.registry = registry
+
         # Load backends
         self.backends = []
 
     def handle_livestatus_query(self, sock, request):
+        start = time.time()
         keepalive, queryobj = self.parser.parse(request)
 
         # Give response socket to the query
         if hasattr(queryobj, 'output_sock'):
             queryobj.output_sock = sock
+        if hasattr(queryobj, 'trace'):
+            queryobj.trace = self.trace
+        if hasattr(queryobj, 'registry'):
+            queryobj.registry = self.registry
 
-        queryobj.execute(self.backends)
+        if isinstance(queryobj, Query):
+            self.registry.inc('livestatus_queries')
+        else:
+            self.registry.inc('livestatus_commands')
+
+        try:
+            queryobj.execute(self.backends)
+        except:
+            self.registry.inc('livestatus_errors')
+            raise
+        self.registry.observe('livestatus_query_latency', time.time() - start)
 
         return keepalive
 
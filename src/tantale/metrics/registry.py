@@ -0,0 +1,210 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import time
+import threading
+from multiprocessing.sharedctypes import RawArray
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 (Pypi 'ordereddict')
+    from ordereddict import OrderedDict
+
+# Histograms buckets upper bounds (seconds)
+BUCKETS = (
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, float('inf'),
+)
+
+# Metrics known by processes : name, type, description
+METRICS = (
+    # Input listeners
+    ('input_connections', 'gauge', 'Connected Input clients'),
+    ('input_records', 'counter', 'Records (lines, frames) received'),
+    ('input_dropped', 'counter', 'Records dropped (queue full)'),
+    ('input_paused', 'counter', 'Clients pauses (backpressure)'),
+    ('input_errors', 'counter', 'Input clients errors'),
+    # Queue and Input_Backend
+    ('input_queue_fill', 'gauge', 'Used part of Input queue (0 to 1)'),
+    ('input_checks', 'counter', 'Checks processed by Input_Backend'),
+    ('input_decode_errors', 'counter',
+     'Records failed to decode, invalid checks'),
+    # Backends (Input)
+    ('backend_pending', 'gauge', 'Checks waiting in backends'),
+    ('backend_batch_size', 'gauge', 'Backends batch size'),
+    ('backend_ttl', 'gauge', 'Backends flush delay (seconds)'),
+    ('backend_bulk_latency', 'histogram', 'Status bulk latency (seconds)'),
+    ('backend_bulk_checks', 'counter', 'Checks sent to backends'),
+    ('backend_bulk_errors', 'counter', 'Failed status bulks'),
+    ('backend_rejected', 'counter', 'Checks rejected by backends'),
+    ('backend_compacted', 'counter',
+     'Unchanged checks not written (heartbeat compaction)'),
+    ('backend_spool_bytes', 'gauge', 'Size of backends disk spool'),
+    # Freshness
+    ('freshness_runs', 'counter', 'Freshness updates'),
+    ('freshness_duration', 'gauge', 'Last freshness update (seconds)'),
+    ('freshness_outdated', 'counter',
+     'Checks outdated (heap, update_by_query modes)'),
+    ('freshness_deadlines', 'gauge', 'Freshness deadlines (heap mode)'),
+    # Livestatus
+    ('livestatus_queries', 'counter', 'Livestatus queries'),
+    ('livestatus_commands', 'counter', 'Livestatus commands'),
+    ('livestatus_errors', 'counter', 'Livestatus queries failed'),
+    ('livestatus_query_latency', 'histogram',
+     'Livestatus queries latency (seconds)'),
+    # Client
+    ('client_results', 'counter', 'Client results sent'),
+    ('client_send_errors', 'counter', 'Client send failures'),
+)
+
+# Prometheus names prefix
+PREFIX = 'tantale_'
+
+
+class Registry(object):
+    """
+    Counters, gauges and histograms shared by tantale processes
+
+    Values are in shared memory, one row by process (no cross process
+    lock, a process only writes its row), rows are summed when read. Rows are
+    allocated once processes are known, before forking them. Each
+    process is given its row before start (row 0 is main process).
+    """
+
+    def __init__(self, metrics=METRICS):
+        self.start = int(time.time())
+        self.metrics = OrderedDict(
+            (name, (kind, description))
+            for name, kind, description in metrics)
+
+        # Offsets in a row (histograms : buckets, count, sum)
+        self.offsets = {}
+        self.width = 0
+        for name, (kind, description) in self.metrics.items():
+            self.offsets[name] = self.width
+            if kind == 'histogram':
+                self.width += len(BUCKETS) + 2
+            else:
+                self.width += 1
+
+        self.rows = 0
+        self.row = 0
+        self.values = None
+
+        # Threads of a process share its row
+        self.lock = threading.Lock()
+
+    def allocate(self, rows):
+        """
+        Create shared values (before forking processes)
+        """
+        self.rows = rows
+        self.values = RawArray('d', rows * self.width)
+
+    def inc(self, name, value=1):
+        """
+        Increment a counter (or gauge)
+        """
+        if self.values is None:
+            return
+        offset = self.row * self.width + self.offsets[name]
+        with self.lock:
+            self.values[offset] += value
+
+    def set(self, name, value):
+        """
+        Set a gauge (value of this process)
+        """
+        if self.values is None:
+            return
+        self.values[self.row * self.width + self.offsets[name]] = value
+
+    def observe(self, name, value):
+        """
+        Account a value in a histogram
+        """
+        if self.values is None:
+            return
+        offset = self.row * self.width + self.offsets[name]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        with self.lock:
+            self.values[offset + i] += 1
+            self.values[offset + len(BUCKETS)] += 1
+            self.values[offset + len(BUCKETS) + 1] += value
+
+    def snapshot(self):
+        """
+        Values summed over processes
+            counters / gauges : value
+            histograms : (buckets counts, count, sum)
+        """
+        totals = [0.0] * self.width
+        if self.values is not None:
+            values = self.values[:]
+            for row in range(self.rows):
+                base = row * self.width
+                for i in range(self.width):
+                    totals[i] += values[base + i]
+
+        snapshot = OrderedDict()
+        for name, (kind, description) in self.metrics.items():
+            offset = self.offsets[name]
+            if kind == 'histogram':
+                snapshot[name] = (
+                    totals[offset:offset + len(BUCKETS)],
+                    totals[offset + len(BUCKETS)],
+                    totals[offset + len(BUCKETS) + 1])
+            else:
+                snapshot[name] = totals[offset]
+        return snapshot
+
+    def status(self):
+        """
+        Flat values (Livestatus status table)
+        Histograms as <name>_count, <name>_avg
+        """
+        status = {}
+        for name, value in self.snapshot().items():
+            if self.metrics[name][0] == 'histogram':
+                buckets, count, total = value
+                status['%s_count' % name] = int(count)
+                status['%s_avg' % name] = 0
+                if count:
+                    status['%s_avg' % name] = round(total / count, 3)
+            else:
+                status[name] = self._number(value)
+        return status
+
+    def prometheus(self):
+        """
+        Prometheus text exposition format
+        """
+        lines = []
+        for name, value in self.snapshot().items():
+            kind, description = self.metrics[name]
+            metric = PREFIX + name
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            if kind == 'histogram':
+                buckets, count, total = value
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, buckets):
+                    cumulative += bucket
+                    lines.append('%s_bucket{le="%s"} %d' % (
+                        metric, '+Inf' if bound == float('inf') else bound,
+                        cumulative))
+                lines.append('%s_sum %s' % (metric, repr(total)))
+                lines.append('%s_count %d' % (metric, count))
+            else:
+                lines.append('%s %s' % (metric, self._number(value)))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _number(value):
+        if value == int(value):
+            return int(value)
+        return value
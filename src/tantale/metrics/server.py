@@ -0,0 +1,81 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+import signal
+import logging
+import traceback
+from threading import Thread
+
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+try:
+    from setproctitle import setproctitle, getproctitle
+except ImportError:
+    setproctitle = None
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serve registry in Prometheus text format (any path)
+    """
+    def do_GET(self):
+        try:
+            body = self.server.registry.prometheus().encode('utf-8')
+        except:
+            self.server.log.error('Metrics: failed to read registry')
+            self.server.log.debug(traceback.format_exc())
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.log.debug('Metrics: ' + format % args)
+
+
+class MetricsServer(object):
+    """
+    Prometheus endpoint of tantale processes metrics
+    """
+    def __init__(self, config, registry):
+        # Initialize Logging
+        self.log = logging.getLogger('tantale.metrics')
+
+        # Initialize Members
+        self.config = config
+        self.registry = registry
+
+    def run(self, init_done):
+        if setproctitle:
+            setproctitle('%s - Metrics' % getproctitle())
+
+        try:
+            port = int(self.config['modules']['Metrics']['port'])
+            httpd = HTTPServer(('', port), MetricsHandler)
+        except:
+            self.log.critical('Socket bind failed.')
+            self.log.debug(traceback.format_exc())
+            return
+        httpd.registry = self.registry
+        httpd.log = self.log
+
+        self.log.info("Listening on %s" % port)
+        init_done.set()
+
+        # Signals
+        def sig_handler(signum, frame):
+            self.log.debug("%s received" % signum)
+        signal.signal(signal.SIGTERM, sig_handler)
+
+        # Making a daemon thread to handle instant stop
+        t = Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+
+        signal.pause()
+        self.log.info("Exit")
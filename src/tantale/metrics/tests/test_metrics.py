@@ -0,0 +1,52 @@
+# coding=utf-8
+
+from __future__ import print_function
+
+from multiprocessing import Process
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tantale.metrics.registry import Registry
+
+
+class RegistryTC(unittest.TestCase):
+    def test_Processes(self):
+        registry = Registry()
+
+        def work():
+            for i in range(1000):
+                registry.inc('input_records')
+            registry.set('backend_pending', 2)
+            registry.observe('backend_bulk_latency', 0.2)
+
+        registry.allocate(3)
+        processes = []
+        for row in (1, 2):
+            registry.row = row
+            processes.append(Process(target=work))
+            processes[-1].start()
+        registry.row = 0
+        for process in processes:
+            process.join()
+
+        status = registry.status()
+        self.assertEqual(status['input_records'], 2000)
+        self.assertEqual(status['backend_pending'], 4)
+        self.assertEqual(status['backend_bulk_latency_count'], 2)
+        self.assertEqual(status['backend_bulk_latency_avg'], 0.2)
+
+        text = registry.prometheus()
+        self.assertIn('tantale_input_records 2000\n', text)
+        self.assertIn(
+            'tantale_backend_bulk_latency_bucket{le="0.1"} 0\n', text)
+        self.assertIn(
+            'tantale_backend_bulk_latency_bucket{le="0.25"} 2\n', text)
+
+    def test_NotAllocated(self):
+        registry = Registry()
+        registry.inc('input_records')
+        registry.observe('livestatus_query_latency', 1)
+        self.assertEqual(registry.status()['input_records'], 0)
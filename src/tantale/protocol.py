@@ -0,0 +1,101 @@
+# coding=utf-8
+"""
+Binary framing of Client -> Input traffic (msgpack)
+
+Require python 'msgpack' (Pypi) on both sides.
+
+Connection starts with BINARY_MAGIC byte (never starts a JSON line),
+then frames :
+    4 bytes big endian payload length, msgpack payload
+
+Payload is a list [strings, checks] :
+    strings : new strings appended to the connection string table
+    checks : checks list (same forms as JSON lines), STRING_FIELDS
+             values may be indexes in the connection string table
+"""
+
+from __future__ import print_function
+
+import struct
+from six import string_types
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BINARY_MAGIC = b'\xc1'
+FRAME_HEADER = struct.Struct('!I')
+
+# Check keys sent as string table indexes
+STRING_FIELDS = ('hostname', 'check', 'contacts')
+
+# Limits (per connection)
+MAX_STRINGS = 65536
+MAX_FRAME = 16777216
+
+
+class StringTable(object):
+    """
+    Client side string table (reset on each connection)
+    """
+    def __init__(self):
+        self.index = {}
+        self.pending = []
+
+    def ref(self, string):
+        if string in self.index:
+            return self.index[string]
+        if len(self.index) >= MAX_STRINGS:
+            # Table full, send string itself
+            return string
+
+        idx = len(self.index)
+        self.index[string] = idx
+        self.pending.append(string)
+        return idx
+
+    def frame(self, checks):
+        """
+        Build a frame from checks dicts
+        """
+        refs = []
+        for check in checks:
+            check = dict(check)
+            for key in STRING_FIELDS:
+                value = check.get(key)
+                if isinstance(value, string_types):
+                    check[key] = self.ref(value)
+                elif isinstance(value, list):
+                    check[key] = [
+                        self.ref(v) if isinstance(v, string_types) else v
+                        for v in value]
+            refs.append(check)
+
+        strings = self.pending
+        self.pending = []
+
+        payload = msgpack.packb([strings, refs], use_bin_type=True)
+        return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def resolve(strings, checks):
+    """
+    Server side : replace string table indexes by strings
+    Checks may be a check, an envelope or a list of both
+    """
+    if isinstance(checks, list):
+        return [resolve(strings, check) for check in checks]
+
+    for key in STRING_FIELDS:
+        value = checks.get(key)
+        if isinstance(value, int):
+            checks[key] = strings[value]
+        elif isinstance(value, list):
+            checks[key] = [
+                strings[v] if isinstance(v, int) else v for v in value]
+
+    if 'checks' in checks:
+        checks['checks'] = resolve(strings, checks['checks'])
+
+    return checks
@@ -12,6 +12,7 @@ from multiprocessing import Process, Event, active_children
 from multiprocessing import JoinableQueue as Queue
 
 from tantale import config_min
+from tantale.metrics.registry import Registry
 from tantale.utils import str_to_bool
 
 try:
@@ -71,52 +72,92 @@ class Server(object):
             self.log.debug("%s received" % signum)
         signal.signal(signal.SIGINT, sig_handler)
         signal.signal(signal.SIGTERM, sig_handler)
+        # Flush request (handled by Input_Backend only), inherited by
+        # processes : not killing them when sent to the processes group
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
 
-        # Spawn processes
+        # Create processes
         modules = self.config.get('modules', {})
+
+        # Processes metrics (allocated once processes known)
+        registry = Registry()
+
+        # Input checks latency (shared with Livestatus)
+        trace = None
+        if (
+            'Input' in modules and
+            str_to_bool(modules['Input']['enabled']) and
+            str_to_bool(modules['Input']['trace'])
+        ):
+            from tantale.input.trace import Trace
+            trace = Trace()
+
         for module in modules:
 
             if module == 'Input':
                 if str_to_bool(modules[module]['enabled']):
                     from tantale.input.server import InputServer
-                    inputserver = InputServer(self.config)
+                    inputserver = InputServer(self.config, trace, registry)
 
                     # Input check Queue
                     queue_size = int(self.config['modules']['Input'].get(
                         'queue_size', 16384))
-                    check_queue = Queue(maxsize=queue_size)
-                    self.log.debug('input_queue_size: %d', queue_size)
+                    if modules[module]['queue_transport'] == 'ring':
+                        from tantale.input.ring import RingQueue
+                        ring_size = int(modules[module]['ring_size'])
+                        check_queue = RingQueue(ring_size)
+                        self.log.debug('input_ring_size: %d', ring_size)
+                    else:
+                        check_queue = Queue(maxsize=queue_size)
+                        self.log.debug('input_queue_size: %d', queue_size)
+
+                    # Decoders (parse checks out of Input_Backend)
+                    backend_queue = check_queue
+                    if inputserver.decode_workers > 0:
+                        backend_queue = Queue(maxsize=queue_size)
+                        for worker in range(inputserver.decode_workers):
+                            processes.append(Process(
+                                name="Input_Decoder_%d" % worker,
+                                target=inputserver.input_decoder,
+                                args=(check_queue, backend_queue, worker),
+                            ))
 
                     # Backends
                     processes.append(Process(
                         name="Input_Backend",
                         target=inputserver.input_backend,
-                        args=(check_queue,),
+                        args=(backend_queue,),
                     ))
-                    self.spawn(processes[-1])
 
-                    # Socket Listener
-                    init_events.append(Event())
-                    processes.append(Process(
-                        name="Input",
-                        target=inputserver.run,
-                        args=(check_queue, init_events[-1],),
-                    ))
-                    self.spawn(processes[-1])
+                    # Socket Listeners
+                    for worker in range(inputserver.input_workers):
+                        if inputserver.input_workers > 1:
+                            name = "Input_%d" % worker
+                        else:
+                            name = "Input"
+                        init_events.append(Event())
+                        processes.append(Process(
+                            name=name,
+                            target=inputserver.run,
+                            args=(check_queue, init_events[-1], worker),
+                        ))
 
-                    # Freshness check
-                    if modules[module]['freshness_interval'] != '0':
+                    # Freshness check (heap mode in Input_Backend)
+                    if (
+                        modules[module]['freshness_interval'] != '0' and
+                        inputserver.freshness_mode != 'heap'
+                    ):
                         processes.append(Process(
                             name="Input_Freshness",
                             target=inputserver.input_freshness,
                             args=(),
                         ))
-                        self.spawn(processes[-1])
 
             elif module == 'Livestatus':
                 if str_to_bool(modules[module]['enabled']):
                     from tantale.livestatus.server import LivestatusServer
-                    livestatusserver = LivestatusServer(self.config)
+                    livestatusserver = LivestatusServer(
+                        self.config, trace, registry)
 
                     # Livestatus
                     init_events.append(Event())
@@ -125,12 +166,11 @@ class Server(object):
                         target=livestatusserver.run,
                         args=(init_events[-1],),
                     ))
-                    self.spawn(processes[-1])
 
             elif module == 'Client':
                 if str_to_bool(modules[module]['enabled']):
                     from tantale.client.server import Client
-                    client = Client(self.config)
+                    client = Client(self.config, registry)
 
                     # Livestatus
                     init_events.append(Event())
@@ -139,7 +179,19 @@ class Server(object):
                         target=client.run,
                         args=(init_events[-1],),
                     ))
-                    self.spawn(processes[-1])
+
+            elif module == 'Metrics':
+                if str_to_bool(modules[module]['enabled']):
+                    from tantale.metrics.server import MetricsServer
+                    metricsserver = MetricsServer(self.config, registry)
+
+                    # Prometheus endpoint
+                    init_events.append(Event())
+                    processes.append(Process(
+                        name="Metrics",
+                        target=metricsserver.run,
+                        args=(init_events[-1],),
+                    ))
 
             else:
                 self.log.error(
@@ -148,6 +200,13 @@ class Server(object):
         if len(processes) == 0:
             self.log.critical('No modules enabled. Quitting')
         else:
+            # Spawn processes, each one writing its metrics row
+            registry.allocate(len(processes) + 1)
+            for row, process in enumerate(processes, 1):
+                registry.row = row
+                self.spawn(process)
+            registry.row = 0
+
             # Check our sub-processes are ready
             for event in init_events:
                 # Maximum time starting